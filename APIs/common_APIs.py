@@ -18,8 +18,6 @@ import threading
 from binascii import unhexlify
 from subprocess import *
 
-import crcmod.predefined
-
 
 '''
 def file_lock(open_file):
@@ -141,51 +139,116 @@ def need_add_lock(lock):
     return sync_with_lock
 
 
+# use to add the instance lock(getattr(self, lock_name)) befow call the method
+def need_add_self_lock(lock_name):
+    def sync_with_lock(func):
+        @functools.wraps(func)
+        def new_func(self, *args, **kwargs):
+            lock = getattr(self, lock_name)
+            lock.acquire()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                lock.release()
+
+        return new_func
+    return sync_with_lock
+
+
 # Hex print
+try:
+    b''.hex(' ')
+
+    def hex_spaced(data):
+        return data.hex(' ') + ' '
+except:
+    def hex_spaced(data):
+        data_hex = binascii.hexlify(data)
+        return ' '.join(map(''.join, zip(data_hex[::2], data_hex[1::2]))) + ' '
+
+
 def protocol_data_printB(data, title=''):
-    if isinstance(data, type(b'')):
-        pass
-    else:
+    if isinstance(data, type(u'')):
         data = data.encode('utf-8')
     ret = title + ' %s bytes:' % (len(data)) + '\n\t\t'
-    counter = 0
-    for item in data:
-        if isinstance('', type(b'')):
-            ret += '{:02x}'.format(ord(item)) + ' '
-        else:
-            ret += '{:02x}'.format(item) + ' '
-        counter += 1
-        if counter == 10:
-            ret += ' ' + '\n\t\t'
-            counter -= 10
-
+    if not data:
+        return ret
+
+    # 10 bytes per row, every byte takes 3 chars
+    data_hex = hex_spaced(data)
+    ret += ' \n\t\t'.join([data_hex[i:i + 30]
+                            for i in range(0, len(data_hex), 30)])
+    if len(data) % 10 == 0:
+        ret += ' \n\t\t'
     return ret
 
 
+# str(func(*args)), done only when a log handler really emits it
+class LazyStr(object):
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        value = self.func(*self.args)
+        if isinstance(value, str):
+            return value
+        # py2 unicode; None, bytes(py3)... as str() shows them
+        if isinstance(value, type(u'')):
+            return value.encode('utf-8')
+        return str(value)
+
+
+# rendered only when a log handler really emits it
+class HexDump(object):
+    def __init__(self, data, title=''):
+        self.data = data
+        self.title = title
+
+    def __str__(self):
+        return protocol_data_printB(self.data, self.title)
+
+
 # create CRC
 def crc(s):
-    result = 0
-    for i in range(len(s)):
-        result += struct.unpack('B', s[i])[0]
+    result = sum(bytearray(s)) % 0xff
+    return crc_packer[None].pack(result)
+
+
+# crc-ccitt-false: poly 0x1021, init 0xffff, binascii.crc_hqx is table driven
+crc_packer = {
+    None: struct.Struct('B'),
+    False: struct.Struct('>H'),
+    True: struct.Struct('<H'),
+}
 
-    result %= 0xff
-    return struct.pack('B', result)
+
+class CRC16(object):
+    def __init__(self, data=b'', init=0xFFFF):
+        self.crcValue = init
+        if data:
+            self.update(data)
+
+    def update(self, data):
+        if isinstance(data, type(u'')):
+            data = data.encode('utf-8')
+        self.crcValue = binascii.crc_hqx(data, self.crcValue)
+        return self
+
+    def digest(self, reverse=False):
+        return crc_packer[reverse].pack(self.crcValue)
 
 
 # create CRC16
 def crc16(data, reverse=False):
-    if isinstance(data, type(b'')):
-        pass
-    else:
+    if isinstance(data, type(u'')):
         data = data.encode('utf-8')
-    a = binascii.b2a_hex(data)
-    s = unhexlify(a)
-    crc16 = crcmod.predefined.Crc('crc-ccitt-false')
-    crc16.update(s)
-    if reverse == False:
-        return struct.pack('>H', crc16.crcValue)
-    else:
-        return struct.pack('<H', crc16.crcValue)
+    return crc_packer[reverse].pack(binascii.crc_hqx(data, 0xFFFF))
+
+
+def crc16_batch(frames, reverse=False):
+    packer = crc_packer[reverse]
+    return [packer.pack(binascii.crc_hqx(frame, 0xFFFF)) for frame in frames]
 
 
 def get_md5(strtext):
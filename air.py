@@ -27,6 +27,8 @@ from basic.cprint import cprint
 import APIs.common_APIs as common_APIs
 from APIs.common_APIs import my_system_no_check, my_system, my_system_full_output, protocol_data_printB
 from protocol.air_protocol import Air
+from connections.serial_engine import SerialEngine
+from connections.virtual_serial import is_virtual
 
 # 命令行参数梳理， 目前仅有-p 指定串口端口号
 class ArgHandle():
@@ -57,7 +59,16 @@ class ArgHandle():
             # metavar='pattern',
             # required=True,
             default=[],
-            help='Specify serial port',
+            help="Specify serial port: 'x' for COMx, 'pty' or 'pty:/tmp/ttyV0' for a virtual port",
+        )
+
+        parser.add_argument(
+            '--engine',
+            dest='engine',
+            action='store',
+            choices=['thread', 'selector'],
+            default='thread',
+            help="thread: 3 threads per port; selector: one thread for all ports",
         )
         return parser
 
@@ -89,9 +100,9 @@ class MyCmd(Cmd):
         if len(args) > 1 and args[0] in (self.coms_list.keys() + ['all']):
             if args[0] == 'all':
                 for com in self.coms_list:
-                    self.coms_list[com].queue_out.put(' '.join(args[1:]))
+                    self.coms_list[com].add_send_data(' '.join(args[1:]))
             else:
-                self.coms_list[args[0]].queue_out.put(' '.join(args[1:]))
+                self.coms_list[args[0]].add_send_data(' '.join(args[1:]))
         else:
             cprint.warn_p("unknow port: %s!" % (arg))
 
@@ -187,11 +198,20 @@ if __name__ == '__main__':
     # create serial objs
     global coms_list
     coms_list = {}
+    if arg_handle.get_args('engine') == 'selector':
+        engine = SerialEngine(logger=LOG)
+        thread_list.append([engine.run_forever])
     for com_id in arg_handle.get_args('port_list'):
-        coms_list[com_id] = Air('COM' + com_id, logger=LOG)
-        thread_list.append([coms_list[com_id].schedule_loop])
-        thread_list.append([coms_list[com_id].send_data_loop])
-        thread_list.append([coms_list[com_id].recv_data_loop])
+        if is_virtual(com_id):
+            coms_list[com_id] = Air(com_id, logger=LOG)
+        else:
+            coms_list[com_id] = Air('COM' + com_id, logger=LOG)
+        if arg_handle.get_args('engine') == 'selector':
+            engine.add_device(coms_list[com_id])
+        else:
+            thread_list.append([coms_list[com_id].schedule_loop])
+            thread_list.append([coms_list[com_id].send_data_loop])
+            thread_list.append([coms_list[com_id].recv_data_loop])
 
 
 
@@ -25,10 +25,12 @@ from cmd import Cmd
 from collections import defaultdict
 
 import APIs.common_APIs as common_APIs
+import basic.clock as clock
 import connections.my_socket as my_socket
 from APIs.common_APIs import (my_system, my_system_full_output,
                               my_system_no_check, protocol_data_printB)
 from basic.cprint import cprint
+from basic.histogram import LatencyHistogram
 from basic.log_tool import MyLogger
 from protocol.protocol_process import communication_base
 
@@ -114,6 +116,54 @@ class ArgHandle():
             default='air',
             help="Specify device type: 'air', 'led', 'switch'",
         )
+        parser.add_argument(
+            '--sessions',
+            dest='sessions',
+            action='store',
+            default=1,
+            type=int,
+            help='Specify how many app sessions(connection + login) to open, the uuids are shared out among them',
+        )
+        parser.add_argument(
+            '--rate',
+            dest='rate',
+            action='store',
+            default=0,
+            type=float,
+            help='Open loop: send at this rate(msg/s, all sessions) no matter the replies, -t and --t2 are not used',
+        )
+        parser.add_argument(
+            '--warmup',
+            dest='warmup',
+            action='store',
+            default=0,
+            type=float,
+            help='Open loop: seconds at the beginning not measured',
+        )
+        parser.add_argument(
+            '--cooldown',
+            dest='cooldown',
+            action='store',
+            default=0,
+            type=float,
+            help='Open loop: seconds at the end not measured',
+        )
+        parser.add_argument(
+            '--report-interval',
+            dest='report_interval',
+            action='store',
+            default=5,
+            type=float,
+            help='Open loop: seconds between two latency reports',
+        )
+        parser.add_argument(
+            '--timeout',
+            dest='timeout',
+            action='store',
+            default=1000,
+            type=int,
+            help='Open loop: ms without reply to count a msg as lost',
+        )
         return parser
 
     def get_args(self, attrname):
@@ -379,6 +429,8 @@ class AirControl(communication_base):
 
         # state data:
         self.msgst = defaultdict(lambda: {})
+        # open loop: replies go to LoadGenerator.on_response
+        self.rsp_callback = None
 
     def protocol_handler(self, msg):
         self.LOG.yinfo('recv: ' + str(msg))
@@ -386,8 +438,14 @@ class AirControl(communication_base):
         if ((not 'content' in json_msg)
             or (not 'req_id' in json_msg['content'])
             or (json_msg['content']['method'] == 'um_login_pwd')
-            or (json_msg['content']['method'] == 'mdp_msg')
-                or not (json_msg['content']['req_id']) in self.msgst):
+                or (json_msg['content']['method'] == 'mdp_msg')):
+            return 'No_need_send'
+
+        if self.rsp_callback:
+            self.rsp_callback(json_msg['content']['req_id'])
+            return 'No_need_send'
+
+        if not json_msg['content']['req_id'] in self.msgst:
             return 'No_need_send'
 
         rece_time = datetime.datetime.now()
@@ -454,6 +512,151 @@ class AirControl(communication_base):
         return datas
 
 
+def load_msg(device_type, req_id, uuid, seq):
+    if device_type == 'led':
+        return led_control_msg(req_id, uuid, ('on', 'off')[seq % 2])
+    elif device_type == 'switch':
+        return switch_control_msg(req_id, uuid, ('on', 'off')[seq % 2])
+    elif device_type == 'debug':
+        return debug(req_id, uuid)
+    else:
+        return temperature_set_msg(req_id, uuid)
+
+
+# 开环压测: 按固定速率发包, 不等回复; 时延从计划发送时间算起,
+# 发送被阻塞时排队的时间也算在内, 慢响应不会被少算
+class LoadGenerator():
+    # req_id: base_id + seq * sessions + session, unique among all the
+    # sessions however many msgs each one sends
+    def __init__(self, app, logger, uuids, device_type, rate, number, warmup=0, cooldown=0, timeout=1000, base_id=77000000, session=0, sessions=1):
+        self.app = app
+        self.LOG = logger
+        self.uuids = uuids
+        self.device_type = device_type
+        self.rate = float(rate)
+        self.number = number
+        self.warmup = warmup
+        self.cooldown = cooldown
+        self.timeout = timeout / 1000.0
+        self.base_id = base_id
+        self.session = session
+        self.sessions = sessions
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.hist = LatencyHistogram()
+        self.total_hist = LatencyHistogram()
+        self.sent = 0
+        self.lost = 0
+        self.window = (0, 0)
+        self.app.rsp_callback = self.on_response
+
+    # only the msgs planned in the window are measured
+    def in_window(self, intended):
+        return self.window[0] <= intended < self.window[1]
+
+    # all the sessions share one start, so one measure window
+    def run(self, start):
+        total = self.number * len(self.uuids)
+        self.window = (start + self.warmup, start +
+                       total / self.rate - self.cooldown)
+
+        for seq in range(total):
+            intended = start + seq / self.rate
+            delay = intended - clock.monotonic()
+            if delay > 0:
+                clock.sleep(delay)
+            req_id = self.base_id + seq * self.sessions + self.session
+            msg = load_msg(self.device_type, req_id,
+                           self.uuids[seq % len(self.uuids)], seq // len(self.uuids))
+            with self.lock:
+                self.pending[req_id] = intended
+                if self.in_window(intended):
+                    self.sent += 1
+            self.app.queue_out.put(msg)
+
+        deadline = clock.monotonic() + self.timeout
+        while self.pending and clock.monotonic() < deadline:
+            clock.sleep(0.1)
+
+    def on_response(self, req_id):
+        now = clock.monotonic()
+        with self.lock:
+            intended = self.pending.pop(req_id, None)
+        if intended is not None and self.in_window(intended):
+            self.hist.record((now - intended) * 1000000)
+
+    # no reply in timeout: lost, a late reply is ignored
+    def expire(self, final=False):
+        deadline = clock.monotonic() - self.timeout
+        lost = 0
+        with self.lock:
+            for req_id, intended in list(self.pending.items()):
+                if final or intended < deadline:
+                    del self.pending[req_id]
+                    if self.in_window(intended):
+                        lost += 1
+            self.lost += lost
+        return lost
+
+    # the interval histogram and lost count since the last call
+    def collect(self, final=False):
+        lost = self.expire(final)
+        hist = self.hist.take()
+        self.total_hist.merge(hist)
+        return hist, lost
+
+
+def run_loads(logger, loads, interval):
+    start = clock.monotonic()
+    thread_ids = []
+    for load in loads:
+        thread_ids.append(threading.Thread(target=load.run, args=(start,)))
+    for th in thread_ids:
+        th.setDaemon(True)
+        th.start()
+
+    next_report = start + interval
+    while [th for th in thread_ids if th.is_alive()]:
+        clock.sleep(0.1)
+        if clock.monotonic() >= next_report:
+            next_report += interval
+            report_loads(logger, loads)
+    report_loads(logger, loads, final=True)
+
+
+# 各 session 的时延直方图合并后输出
+def report_loads(logger, loads, final=False):
+    hist = LatencyHistogram()
+    lost = 0
+    for load in loads:
+        load_hist, load_lost = load.collect(final)
+        hist.merge(load_hist)
+        lost += load_lost
+
+    if final:
+        total_hist = LatencyHistogram()
+        for load in loads:
+            total_hist.merge(load.total_hist)
+        sent = sum([load.sent for load in loads])
+        logger.info('Total package: %d, rate: %.1f/s, sessions: %d' %
+                    (sent, sum([load.rate for load in loads]), len(loads)))
+        if len(loads) > 1:
+            for i, load in enumerate(loads):
+                logger.info('session %d(%d uuids): %d sent, %d lost, latency: %s' % (
+                    i, len(load.uuids), load.sent, load.lost, latency_summary(load.total_hist)))
+        logger.info('Total latency: ' + latency_summary(total_hist))
+        logger.error('Loss Rate: %.2f%%' % (
+            sum([load.lost for load in loads]) * 100.0 / max(sent, 1)))
+    else:
+        logger.info('%d rsp, %d lost(%.2f%%), latency: %s' % (hist.count, lost, lost * 100.0 / max(
+            hist.count + lost, 1), latency_summary(hist)))
+
+
+def latency_summary(hist):
+    return 'p50 %.2fms, p90 %.2fms, p99 %.2fms, p99.9 %.2fms, max %.2fms' % tuple(
+        [hist.percentile(p) / 1000.0 for p in (50, 90, 99, 99.9)] + [(hist.max or 0) / 1000.0])
+
+
 # 空调遥控器模拟程序入口
 if __name__ == '__main__':
     # sys log init
@@ -473,29 +676,52 @@ if __name__ == '__main__':
     global thread_list
     thread_list = []
 
-    app = AirControl((arg_handle.get_args('server_IP'),
-                      arg_handle.get_args('server_port')), logger=LOG)
-    thread_list.append([app.schedule_loop])
-    thread_list.append([app.send_data_loop])
-    thread_list.append([app.recv_data_loop])
+    # one AirControl per app session, uuids shared out round robin
+    sessions = []
+    for i in range(max(arg_handle.get_args('sessions'), 1)):
+        app = AirControl((arg_handle.get_args('server_IP'),
+                          arg_handle.get_args('server_port')), logger=LOG)
+        thread_list.append([app.schedule_loop])
+        thread_list.append([app.send_data_loop])
+        thread_list.append([app.recv_data_loop])
+        sessions.append(app)
+    session_of = {}
+    for i, uuid in enumerate(uuids):
+        session_of[uuid] = sessions[i % len(sessions)]
 
     # run threads
     sys_proc()
 
     try:
-        while app.connection.get_connected() != True:
-            pass
         msg = login_router(arg_handle.get_args('router_username'), common_APIs.get_md5(
             arg_handle.get_args('router_password')))
-        LOG.info("To login router: " + msg.strip())
-        app.queue_out.put(msg)
+        for app in sessions:
+            while app.connection.get_connected() != True:
+                pass
+            LOG.info("To login router: " + msg.strip())
+            app.queue_out.put(msg)
         time.sleep(1)
 
+        if arg_handle.get_args('rate'):
+            loads = []
+            for i, app in enumerate(sessions):
+                app_uuids = [uuid for uuid in uuids if session_of[uuid] is app]
+                if not app_uuids:
+                    continue
+                loads.append(LoadGenerator(app, LOG, app_uuids, arg_handle.get_args('device_type'),
+                                           arg_handle.get_args('rate') * len(app_uuids) / len(uuids),
+                                           arg_handle.get_args('number_to_send'), warmup=arg_handle.get_args('warmup'),
+                                           cooldown=arg_handle.get_args('cooldown'), timeout=arg_handle.get_args('timeout'),
+                                           session=i, sessions=len(sessions)))
+            run_loads(LOG, loads, arg_handle.get_args('report_interval'))
+            sys.exit()
+
         if arg_handle.get_args('device_type') == 'debug':
             for i in range(arg_handle.get_args('number_to_send')):
                 j = 100000
                 req_id = i + 11000000
                 for uuid in uuids:
+                    app = session_of[uuid]
                     req_id += j
                     j += 1
                     msg = debug(req_id, uuid)
@@ -511,6 +737,7 @@ if __name__ == '__main__':
                 j = 100000
                 req_id = i + 88000000
                 for uuid in uuids:
+                    app = session_of[uuid]
                     req_id += j
                     j += 1
                     msg = temperature_set_msg(req_id, uuid)
@@ -526,6 +753,7 @@ if __name__ == '__main__':
                 j = 100000
                 req_id = i + 88000000
                 for uuid in uuids:
+                    app = session_of[uuid]
                     req_id += j
                     j += 1
                     msg = led_control_msg(req_id, uuid, 'on')
@@ -539,6 +767,7 @@ if __name__ == '__main__':
                 j = 100000
                 req_id = i + 99000000
                 for uuid in uuids:
+                    app = session_of[uuid]
                     req_id += j
                     j += 1
                     msg = led_control_msg(req_id, uuid, 'off')
@@ -554,6 +783,7 @@ if __name__ == '__main__':
                 j = 100000
                 req_id = i + 88000000
                 for uuid in uuids:
+                    app = session_of[uuid]
                     req_id += j
                     j += 1
                     msg = switch_control_msg(req_id, uuid, 'on')
@@ -567,6 +797,7 @@ if __name__ == '__main__':
                 j = 100000
                 req_id = i + 99000000
                 for uuid in uuids:
+                    app = session_of[uuid]
                     req_id += j
                     j += 1
                     msg = switch_control_msg(req_id, uuid, 'off')
@@ -580,27 +811,32 @@ if __name__ == '__main__':
         else:
             LOG.error('Not support device!')
 
-        while not app.queue_out.empty():
-            time.sleep(1)
+        for app in sessions:
+            while not app.queue_out.empty():
+                time.sleep(1)
         time.sleep(5)
 
+        msgst = {}
+        for app in sessions:
+            msgst.update(app.msgst)
+
         pkg_lost = 0
         pkg_lost_list = []
         min_delay = 8888888888
         max_delay = 0
         total_delay = 0
-        for item in app.msgst:
-            if 'delaytime' in app.msgst[item]:
-                if app.msgst[item]['delaytime'] > max_delay:
-                    max_delay = app.msgst[item]['delaytime']
-                if app.msgst[item]['delaytime'] < min_delay:
-                    min_delay = app.msgst[item]['delaytime']
-                total_delay += app.msgst[item]['delaytime']
+        for item in msgst:
+            if 'delaytime' in msgst[item]:
+                if msgst[item]['delaytime'] > max_delay:
+                    max_delay = msgst[item]['delaytime']
+                if msgst[item]['delaytime'] < min_delay:
+                    min_delay = msgst[item]['delaytime']
+                total_delay += msgst[item]['delaytime']
             else:
                 pkg_lost += 1
                 pkg_lost_list.append(item)
 
-        LOG.info('Total package: %d' % len(app.msgst))
+        LOG.info('Total package: %d' % len(msgst))
         if pkg_lost_list:
             LOG.error('Package with these ids have lost:')
             for i in pkg_lost_list:
@@ -609,8 +845,8 @@ if __name__ == '__main__':
                                             arg_handle.get_args('number_to_send')) + '%')
         LOG.info('MAX delay time: %dms' % max_delay)
         LOG.yinfo('MIN delay time: %dms' % min_delay)
-        LOG.info('Average delay time(%d / %d): %.2fms' % (total_delay, (len(app.msgst) -
-                                                                        pkg_lost), (total_delay + 0.0) / (len(app.msgst) - pkg_lost)))
+        LOG.info('Average delay time(%d / %d): %.2fms' % (total_delay, (len(msgst) -
+                                                                        pkg_lost), (total_delay + 0.0) / (len(msgst) - pkg_lost)))
 
     except KeyboardInterrupt:
         LOG.info('KeyboardInterrupt!')
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""clock
+by Kobe Gong. 2018-2-12
+use:
+    sleep/monotonic/now go through the current clock, RealClock by default.
+    set_clock(VirtualClock()) before the devices are created: virtual time
+    only moves forward in TaskScheduler.run_for, which jumps from one due
+    task or sleeper to the next without real waiting
+"""
+
+import datetime
+import heapq
+import itertools
+import threading
+import time
+
+real_monotonic = getattr(time, 'monotonic', time.time)
+
+
+class RealClock():
+    virtual = False
+
+    def monotonic(self):
+        return real_monotonic()
+
+    def now(self):
+        return datetime.datetime.now()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class VirtualClock():
+    virtual = True
+
+    # settle: real seconds to wait for the woken sleepers to go back to sleep
+    def __init__(self, start=None, settle=0.05):
+        self.start = start or datetime.datetime.now()
+        self.settle = settle
+        self.time = 0.0
+        self.cond = threading.Condition()
+        self.sleepers = []
+        self.sleeping = 0
+        self.resumed = 0
+        self.counter = itertools.count()
+
+    def monotonic(self):
+        return self.time
+
+    def now(self):
+        return self.start + datetime.timedelta(seconds=self.time)
+
+    def sleep(self, seconds):
+        with self.cond:
+            due = self.time + max(seconds, 0)
+            # nothing to wait, a sleeper here would only cost advance_to a
+            # settle timeout
+            if due <= self.time:
+                return
+            heapq.heappush(self.sleepers, (due, next(self.counter)))
+            self.sleeping += 1
+            self.cond.notify_all()
+            while self.time < due:
+                self.cond.wait()
+            self.sleeping -= 1
+            self.resumed += 1
+            self.cond.notify_all()
+
+    def next_due(self):
+        with self.cond:
+            if self.sleepers:
+                return self.sleepers[0][0]
+            return None
+
+    # wake the sleepers in due order, every step waits for the woken threads
+    # to sleep again(or settle timeout) before time moves on
+    def advance_to(self, target):
+        while True:
+            with self.cond:
+                if not self.sleepers or self.sleepers[0][0] > target:
+                    self.time = max(self.time, target)
+                    self.cond.notify_all()
+                    return
+
+                due = self.sleepers[0][0]
+                woken = 0
+                while self.sleepers and self.sleepers[0][0] <= due:
+                    heapq.heappop(self.sleepers)
+                    woken += 1
+                before = self.sleeping
+                resumed = self.resumed + woken
+                self.time = max(self.time, due)
+                self.cond.notify_all()
+
+                deadline = real_monotonic() + self.settle
+                while self.resumed < resumed or self.sleeping < before:
+                    left = deadline - real_monotonic()
+                    if left <= 0:
+                        break
+                    self.cond.wait(left)
+
+    def advance(self, seconds):
+        self.advance_to(self.time + seconds)
+
+
+clock = RealClock()
+
+
+def set_clock(new_clock):
+    global clock
+    clock = new_clock
+    return clock
+
+
+def get_clock():
+    return clock
+
+
+def sleep(seconds):
+    clock.sleep(seconds)
+
+
+def monotonic():
+    return clock.monotonic()
+
+
+def now():
+    return clock.now()
+
+
+if __name__ == '__main__':
+    # zero sleeps(time_delay=0) do not wait for the settle timeout
+    virtual_clock = set_clock(VirtualClock())
+
+    def zero_sleeper():
+        while True:
+            sleep(1)
+            sleep(0)
+
+    th = threading.Thread(target=zero_sleeper)
+    th.daemon = True
+    th.start()
+    time.sleep(0.1)
+    start = real_monotonic()
+    virtual_clock.advance_to(20)
+    print('20 virtual seconds: %.3fs' % (real_monotonic() - start))
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""fleet store
+by Kobe Gong. 2018-2-13
+use:
+    one FleetStore per device config, get_fleet(config, 'Attribute_initialization')
+    "_xxx" items: per device state, one column per item, row = device index
+    other items: shared read-only config, kept once
+    class Door(FleetView, BaseSim), the device object is a view of its row
+"""
+
+import copy
+import threading
+from array import array
+
+import APIs.common_APIs as common_APIs
+
+int_types = tuple(set([type(0), type(2 ** 64)]))
+immutable_types = tuple(set([type(None), bool, float, complex, tuple, frozenset,
+                             type(''), type(b''), type(u'')])) + int_types
+
+
+missing = object()
+
+
+def fit_array(value):
+    return isinstance(value, int_types) and not isinstance(value, bool)
+
+
+class FleetStore():
+    def __init__(self, attrs):
+        self.lock = threading.Lock()
+        self.shared = {}
+        self.init_values = {}
+        # int items: one array per item; other items: {index: value} only
+        # for the devices changed from the init value
+        self.arrays = {}
+        self.sparse = {}
+        self.columns = set()
+        self.size = 0
+        for item, value in attrs.items():
+            if not item.startswith('_'):
+                self.shared[item] = value
+                continue
+            self.columns.add(item)
+            self.init_values[item] = value
+            if fit_array(value):
+                self.arrays[item] = array('l')
+            else:
+                self.sparse[item] = {}
+
+    def add_device(self):
+        with self.lock:
+            index = self.size
+            for item, column in self.arrays.items():
+                column.append(self.init_values[item])
+            self.size += 1
+        return index
+
+    # item added after init, None for the devices that do not have it
+    def add_column(self, item):
+        with self.lock:
+            if item not in self.columns:
+                self.init_values[item] = None
+                self.sparse[item] = {}
+                self.columns.add(item)
+
+    # to_sparse may move the item from arrays to sparse at any time, so the
+    # arrays dict is read only once
+    def get(self, index, item):
+        column = self.arrays.get(item)
+        if column is not None:
+            return column[index]
+        values = self.sparse[item]
+        # one read, a set may pop the index at any time
+        value = values.get(index, missing)
+        if value is not missing:
+            return value
+        init = self.init_values[item]
+        if isinstance(init, immutable_types):
+            return init
+        # list, dict...: every device gets its own copy, not the shared one
+        with self.lock:
+            value = values.get(index, missing)
+            if value is missing:
+                value = values[index] = copy.deepcopy(init)
+            return value
+
+    def set(self, index, item, value):
+        old = self.get(index, item)
+        if old == value and type(old) is type(value):
+            return False
+        with self.lock:
+            column = self.arrays.get(item)
+            if column is not None:
+                if fit_array(value):
+                    try:
+                        column[index] = value
+                        return True
+                    except OverflowError:
+                        pass
+                self.to_sparse(item)
+
+            if value == self.init_values[item] and type(value) is type(self.init_values[item]) \
+                    and isinstance(value, immutable_types):
+                self.sparse[item].pop(index, None)
+            else:
+                self.sparse[item][index] = value
+        return True
+
+    # the value does not fit the array(bool, float, too big...), with the lock held
+    def to_sparse(self, item):
+        init = self.init_values[item]
+        self.sparse[item] = dict([(index, value) for index, value in enumerate(
+            self.arrays[item]) if value != init])
+        del self.arrays[item]
+
+    def has(self, index, item):
+        return item in self.columns and self.get(index, item) is not None
+
+    def items(self, index):
+        return [item for item in list(self.columns) if self.get(index, item) is not None]
+
+    # bulk ops, on the whole columns
+    def column(self, item):
+        column = self.arrays.get(item)
+        if column is not None:
+            return column[:]
+        values = [self.init_values[item]] * self.size
+        for index, value in list(self.sparse[item].items()):
+            values[index] = value
+        return values
+
+    def snapshot(self, items=None):
+        return dict([(item, self.column(item)) for item in (items or list(self.columns))])
+
+    def count(self, item, value):
+        column = self.arrays.get(item)
+        if column is not None:
+            return column.count(value)
+        changed = list(self.sparse[item].values())
+        if value == self.init_values[item]:
+            return self.size - len(changed) + changed.count(value)
+        return changed.count(value)
+
+
+class FleetView(object):
+    # fleet and fleet_index must be set before any "_xxx" item is used
+    def __getattr__(self, name):
+        fleet = self.__dict__.get('fleet')
+        if fleet is not None:
+            if name in fleet.columns:
+                return fleet.get(self.__dict__['fleet_index'], name)
+            if name in fleet.shared:
+                return fleet.shared[name]
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        fleet = self.__dict__.get('fleet')
+        if fleet is not None and name in fleet.columns:
+            if fleet.set(self.__dict__['fleet_index'], name, value):
+                tracked_items = self.__dict__.get('tracked_items')
+                if tracked_items and name in tracked_items:
+                    self.mark_dirty(name)
+        else:
+            super(FleetView, self).__setattr__(name, value)
+
+    def has_item(self, item):
+        return self.fleet.has(self.fleet_index, item) or item in self.__dict__
+
+    def get_item_names(self):
+        return self.fleet.items(self.fleet_index)
+
+    def add_item(self, item, value):
+        if item.startswith('_'):
+            self.fleet.add_column(item)
+        super(FleetView, self).add_item(item, value)
+
+
+fleet_lock = threading.Lock()
+fleets = {}
+
+
+@common_APIs.need_add_lock(fleet_lock)
+def get_fleet(config, section):
+    key = (config.__name__, section)
+    if key not in fleets:
+        fleets[key] = FleetStore(getattr(config, section))
+    return fleets[key]
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""latency histogram
+by Kobe Gong. 2018-2-14
+use:
+    log-linear buckets like HdrHistogram: values(int, us) under 2**bits are
+    exact, every next power of 2 range is cut into 2**(bits-1) linear
+    buckets, the relative error is below 1 / 2**(bits-1)
+"""
+
+import threading
+
+
+class LatencyHistogram():
+    def __init__(self, bits=7):
+        self.bits = bits
+        self.half = 1 << (bits - 1)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def index(self, value):
+        if value < 2 * self.half:
+            return value
+        shift = value.bit_length() - self.bits
+        return (shift + 1) * self.half + (value >> shift) - self.half
+
+    # highest value of the bucket
+    def value_at(self, index):
+        if index < 2 * self.half:
+            return index
+        shift = index // self.half - 1
+        return ((index - shift * self.half + 1) << shift) - 1
+
+    def record(self, value, count=1):
+        value = max(int(value), 0)
+        index = self.index(value)
+        with self.lock:
+            self.counts[index] = self.counts.get(index, 0) + count
+            self.count += count
+            self.total += value * count
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def merge(self, other):
+        with other.lock:
+            counts = dict(other.counts)
+            count, total, vmin, vmax = other.count, other.total, other.min, other.max
+        with self.lock:
+            for index, n in counts.items():
+                self.counts[index] = self.counts.get(index, 0) + n
+            self.count += count
+            self.total += total
+            if vmin is not None and (self.min is None or vmin < self.min):
+                self.min = vmin
+            if vmax is not None and (self.max is None or vmax > self.max):
+                self.max = vmax
+
+    # swap out the recorded values, for interval reports
+    def take(self):
+        snapshot = LatencyHistogram(self.bits)
+        with self.lock:
+            snapshot.counts, snapshot.count, snapshot.total = self.counts, self.count, self.total
+            snapshot.min, snapshot.max = self.min, self.max
+            self.reset()
+        return snapshot
+
+    def percentile(self, percent):
+        with self.lock:
+            if not self.count:
+                return 0
+            rank = max(int(self.count * percent / 100.0 + 0.5), 1)
+            seen = 0
+            for index in sorted(self.counts):
+                seen += self.counts[index]
+                if seen >= rank:
+                    return min(self.value_at(index), self.max)
+            return self.max
+
+    def mean(self):
+        if not self.count:
+            return 0
+        return self.total / float(self.count)
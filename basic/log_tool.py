@@ -9,11 +9,38 @@ import logging
 import os
 import re
 import sys
-import traceback
+import threading
 from logging.handlers import RotatingFileHandler
 
 from .cprint import cprint
 
+try:
+    import queue as Queue
+except:
+    import Queue
+
+try:
+    from logging.handlers import QueueHandler
+except ImportError:
+    class QueueHandler(logging.Handler):
+        def __init__(self, queue):
+            logging.Handler.__init__(self)
+            self.queue = queue
+
+        def prepare(self, record):
+            msg = self.format(record)
+            record.message = msg
+            record.msg = msg
+            record.args = None
+            record.exc_info = None
+            return record
+
+        def emit(self, record):
+            try:
+                self.queue.put_nowait(self.prepare(record))
+            except Exception:
+                self.handleError(record)
+
 if re.search(r'linux', sys.platform):
     import coloredlogs
     coloredlogs.DEFAULT_DATE_FORMAT = ''
@@ -57,8 +84,98 @@ BACKGROUND_YELLOW = 0xe0  # yellow.
 BACKGROUND_WHITE = 0xf0  # white.
 
 
+basename_cache = {}
+
+# bumped whenever a handler or level may have changed, loggers then
+# recompute their cached threshold
+log_generation = 0
+
+
+def update_generation():
+    global log_generation
+    log_generation += 1
+
+
+class DeviceFilter(logging.Filter):
+    def __init__(self, dev):
+        logging.Filter.__init__(self)
+        self.dev = dev
+
+    def filter(self, record):
+        record.dev = self.dev
+        return True
+
+
+class BatchFileHandler(RotatingFileHandler):
+    # flushed once per batch by LogPipeline instead of once per record
+    def flush(self):
+        pass
+
+    def sync(self):
+        RotatingFileHandler.flush(self)
+
+
+class LogPipeline():
+    def __init__(self, prefix, files=4, level=logging.DEBUG, maxBytes=50 * 1024 * 1024, backupCount=5, batch_size=1000):
+        self.queue = Queue.Queue()
+        self.level = level
+        self.batch_size = batch_size
+        self.need_stop = False
+        self.fmt = logging.Formatter(
+            '[%(asctime)s] [%(levelname)s] [dev %(dev)s] %(message)s')
+        self.handlers = []
+        for i in range(files):
+            handler = BatchFileHandler(
+                '%s_%d.log' % (prefix, i), maxBytes=maxBytes, backupCount=backupCount)
+            handler.setFormatter(self.fmt)
+            self.handlers.append(handler)
+        self.thread = None
+
+    def get_handler(self, dev, level=None):
+        handler = QueueHandler(self.queue)
+        handler.addFilter(DeviceFilter(dev))
+        handler.setLevel(self.level if level is None else level)
+        return handler
+
+    def write_records(self, records):
+        handlers = set()
+        for record in records:
+            handler = self.handlers[record.dev % len(self.handlers)]
+            handler.handle(record)
+            handlers.add(handler)
+        for handler in handlers:
+            handler.sync()
+
+    def writer_loop(self):
+        while self.need_stop == False or not self.queue.empty():
+            try:
+                records = [self.queue.get(timeout=1)]
+            except Queue.Empty:
+                continue
+
+            while len(records) < self.batch_size:
+                try:
+                    records.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+            self.write_records(records)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.writer_loop)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def stop(self):
+        self.need_stop = True
+        if self.thread:
+            self.thread.join()
+        for handler in self.handlers:
+            handler.sync()
+            handler.close()
+
+
 class MyLogger:
-    def __init__(self, path, clevel=logging.DEBUG, cenable=True, flevel=logging.DEBUG, fenable=True, rlevel=logging.DEBUG, renable=False):
+    def __init__(self, path, clevel=logging.DEBUG, cenable=True, flevel=logging.DEBUG, fenable=True, rlevel=logging.DEBUG, renable=False, pipeline=None, dev_index=0):
         if re.search(r'linux', sys.platform):
             coloredlogs.install(level=clevel)
 
@@ -79,7 +196,10 @@ class MyLogger:
             self.p.addHandler(self.sh)
 
         # 设置文件日志
-        if fenable == True:
+        if fenable == True and pipeline:
+            self.fh = pipeline.get_handler(dev_index, flevel)
+            self.p.addHandler(self.fh)
+        elif fenable == True:
             self.fh = logging.FileHandler(path)
             self.fh.setFormatter(self.fmt)
             self.fh.setLevel(flevel)
@@ -93,9 +213,14 @@ class MyLogger:
             self.rh.setLevel(rlevel)
             self.p.addHandler(self.rh)
 
+        self.generation = -1
+        self.threshold = logging.NOTSET
+        update_generation()
+
     def set_level(self, clevel=logging.DEBUG):
         self.critical('Change log level to %s' % (str(clevel)))
         self.p.setLevel(clevel)
+        update_generation()
 
     def set_fmt(self, fmt=logging.Formatter('')):
         self.sh.setFormatter(fmt)
@@ -107,59 +232,60 @@ class MyLogger:
         self.fh.setFormatter(self.fmt)
         self.rh.setFormatter(self.fmt)
 
-    def debug(self, message):
-        s = traceback.extract_stack()
-        msg_prefix = '[' + \
-            os.path.basename(s[-2][0]) + ': ' + str(s[-2][1]) + '] '
-
-        self.cprint.set_colour(FOREGROUND_BLUE)
-        self.p.debug(msg_prefix + message)
-        self.cprint.reset_colour()
-
-    def info(self, message):
-        s = traceback.extract_stack()
-        msg_prefix = '[' + \
-            os.path.basename(s[-2][0]) + ': ' + str(s[-2][1]) + '] '
-
-        self.cprint.set_colour(FOREGROUND_GREEN)
-        self.p.info(msg_prefix + message)
+    # the lowest level any handler will accept, below it a log call is a no-op
+    def get_threshold(self):
+        if self.generation != log_generation:
+            self.generation = log_generation
+            levels = [h.level for h in self.p.handlers]
+            if self.p.propagate:
+                levels += [h.level for h in logging.getLogger().handlers]
+            if levels:
+                self.threshold = max(self.p.getEffectiveLevel(), min(levels))
+            else:
+                self.threshold = max(
+                    self.p.getEffectiveLevel(), logging.WARNING)
+        return self.threshold
+
+    def is_enabled_for(self, level):
+        return level >= self.get_threshold()
+
+    def do_log(self, level, colour, message, args):
+        f = sys._getframe(2)
+        filename = f.f_code.co_filename
+        if filename not in basename_cache:
+            basename_cache[filename] = os.path.basename(filename)
+        msg_prefix = '[%s: %d] ' % (basename_cache[filename], f.f_lineno)
+
+        self.cprint.set_colour(colour)
+        if args or isinstance(message, (type(''), type(u''))):
+            self.p.log(level, msg_prefix + message, *args)
+        else:
+            self.p.log(level, msg_prefix + '%s', message)
         self.cprint.reset_colour()
 
-    def yinfo(self, message):
-        s = traceback.extract_stack()
-        msg_prefix = '[' + \
-            os.path.basename(s[-2][0]) + ': ' + str(s[-2][1]) + '] '
+    def debug(self, message, *args):
+        if logging.DEBUG >= self.get_threshold():
+            self.do_log(logging.DEBUG, FOREGROUND_BLUE, message, args)
 
-        self.cprint.set_colour(FOREGROUND_YELLOW)
-        self.p.info(msg_prefix + message)
-        self.cprint.reset_colour()
+    def info(self, message, *args):
+        if logging.INFO >= self.get_threshold():
+            self.do_log(logging.INFO, FOREGROUND_GREEN, message, args)
 
-    def warn(self, message):
-        s = traceback.extract_stack()
-        msg_prefix = '[' + \
-            os.path.basename(s[-2][0]) + ': ' + str(s[-2][1]) + '] '
+    def yinfo(self, message, *args):
+        if logging.INFO >= self.get_threshold():
+            self.do_log(logging.INFO, FOREGROUND_YELLOW, message, args)
 
-        self.cprint.set_colour(FOREGROUND_PINK)
-        self.p.warn(msg_prefix + message)
-        self.cprint.reset_colour()
+    def warn(self, message, *args):
+        if logging.WARNING >= self.get_threshold():
+            self.do_log(logging.WARNING, FOREGROUND_PINK, message, args)
 
-    def error(self, message):
-        s = traceback.extract_stack()
-        msg_prefix = '[' + \
-            os.path.basename(s[-2][0]) + ': ' + str(s[-2][1]) + '] '
+    def error(self, message, *args):
+        if logging.ERROR >= self.get_threshold():
+            self.do_log(logging.ERROR, FOREGROUND_RED, message, args)
 
-        self.cprint.set_colour(FOREGROUND_RED)
-        self.p.error(msg_prefix + message)
-        self.cprint.reset_colour()
-
-    def critical(self, message):
-        s = traceback.extract_stack()
-        msg_prefix = '[' + \
-            os.path.basename(s[-2][0]) + ': ' + str(s[-2][1]) + '] '
-
-        self.cprint.set_colour(FOREGROUND_RED)
-        self.p.critical(msg_prefix + message)
-        self.cprint.reset_colour()
+    def critical(self, message, *args):
+        if logging.CRITICAL >= self.get_threshold():
+            self.do_log(logging.CRITICAL, FOREGROUND_RED, message, args)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""state store
+by Kobe Gong. 2018-2-9
+use:
+    class BaseSim(DirtyTracker), after track_items() every change of the
+    tracked attributes is recorded, take_dirty() returns and clears them.
+    in-place changes(list/dict item) must call mark_dirty() by hand
+    set_change_queue(queue): the device is put in the shared queue when it
+    gets dirty, one thread for all the devices takes them, no wait per device
+"""
+
+import threading
+
+
+class DirtyTracker(object):
+    def __setattr__(self, name, value):
+        tracked_items = self.__dict__.get('tracked_items')
+        if tracked_items and name in tracked_items:
+            changed = name not in self.__dict__ or self.__dict__[
+                name] != value
+            object.__setattr__(self, name, value)
+            if changed:
+                self.mark_dirty(name)
+        else:
+            object.__setattr__(self, name, value)
+
+    def tracking(self):
+        return 'tracked_items' in self.__dict__
+
+    def track_items(self, items):
+        self.__dict__['dirty_cond'] = threading.Condition()
+        self.__dict__['dirty_items'] = set()
+        self.__dict__['tracked_items'] = set(items)
+
+    def set_change_queue(self, queue):
+        self.__dict__['change_queue'] = queue
+
+    def mark_dirty(self, item):
+        cond = self.__dict__.get('dirty_cond')
+        if cond is None:
+            return
+        with cond:
+            # already in the queue if there are dirty items not taken
+            notify = not self.dirty_items
+            self.dirty_items.add(item)
+            cond.notify_all()
+        queue = self.__dict__.get('change_queue')
+        if notify and queue is not None:
+            queue.put(self)
+
+    def take_dirty(self, wait=False, timeout=None):
+        cond = self.__dict__.get('dirty_cond')
+        if cond is None:
+            return set()
+        with cond:
+            if wait and not self.dirty_items:
+                cond.wait(timeout)
+            items = self.dirty_items
+            self.__dict__['dirty_items'] = set()
+        return items
@@ -3,8 +3,16 @@
 
 """task handle
 by Kobe Gong. 2018-1-2
+use:
+    all Task objects share one scheduler: a timer thread and a few workers,
+    the tasks of one Task always run on the same worker. the task funcs must
+    not block(no long sleep, no waiting on sockets or queues), one blocked
+    func holds up every Task on its worker; a func running longer than its
+    interval is warned in the log
 """
 
+import heapq
+import itertools
 import logging
 import os
 import re
@@ -13,13 +21,149 @@ import sys
 import threading
 import time
 
+import APIs.common_APIs as common_APIs
+import basic.clock as clock
+from basic.clock import monotonic
 from basic.log_tool import MyLogger
 
+try:
+    import queue as Queue
+except:
+    import Queue
+
 if sys.getdefaultencoding() != 'utf-8':
     reload(sys)
     sys.setdefaultencoding('utf-8')
 
 
+class TaskScheduler():
+    tick = 0.01
+
+    def __init__(self, logger=None, workers=4):
+        self.LOG = logger
+        self.heap = []
+        self.cond = threading.Condition()
+        self.counter = itertools.count()
+        self.workers = [Queue.Queue() for i in range(workers)]
+        self.need_stop = False
+        self.thread_ids = []
+
+    def start(self):
+        # virtual clock: no timer/worker threads, tasks run in run_for
+        if clock.get_clock().virtual:
+            return
+        thread_list = []
+        thread_list.append([self.timer_loop])
+        for queue in self.workers:
+            thread_list.append([self.worker_loop, queue])
+        for th in thread_list:
+            self.thread_ids.append(threading.Thread(target=th[0], args=th[1:]))
+
+        for th in self.thread_ids:
+            th.setDaemon(True)
+            th.start()
+
+    def stop(self):
+        self.need_stop = True
+        with self.cond:
+            self.cond.notify()
+
+    def schedule(self, task_obj, task, due):
+        task['due'] = due
+        with self.cond:
+            heapq.heappush(self.heap, (due, next(self.counter), task_obj, task))
+            if self.heap[0][3] is task:
+                self.cond.notify()
+
+    def timer_loop(self):
+        while self.need_stop == False:
+            with self.cond:
+                if not self.heap:
+                    self.cond.wait()
+                    continue
+                due = self.heap[0][0]
+                now = monotonic()
+                if due > now:
+                    self.cond.wait(due - now)
+                    continue
+                due, seq, task_obj, task = heapq.heappop(self.heap)
+
+            # deleted or replaced tasks are dropped here, not searched in heap
+            if task['state'] != 'active' or task_obj.need_stop:
+                continue
+            # all tasks of one Task run on the same worker, one by one
+            self.workers[task_obj.index % len(self.workers)].put(
+                (task_obj, task))
+
+    # virtual clock only: jump from due to due(tasks and sleepers) until
+    # seconds of virtual time passed, tasks run in the caller thread
+    def run_for(self, seconds):
+        virtual_clock = clock.get_clock()
+        end = virtual_clock.monotonic() + seconds
+        while self.need_stop == False:
+            with self.cond:
+                task_due = self.heap[0][0] if self.heap else None
+            dues = [due for due in (task_due, virtual_clock.next_due())
+                    if due is not None and due <= end]
+            if not dues:
+                break
+            due = min(dues)
+            virtual_clock.advance_to(due)
+            if task_due is None or task_due > due:
+                continue
+
+            with self.cond:
+                due, seq, task_obj, task = heapq.heappop(self.heap)
+            self.run_task(task_obj, task)
+        virtual_clock.advance_to(end)
+
+    def worker_loop(self, queue):
+        while self.need_stop == False:
+            task_obj, task = queue.get()
+            self.run_task(task_obj, task)
+
+    def run_task(self, task_obj, task):
+        if task['state'] != 'active' or task_obj.need_stop:
+            return
+
+        start = monotonic()
+        try:
+            task_obj.call(task)
+        except SystemExit:
+            task_obj.stop()
+            return
+        except Exception as e:
+            task_obj.LOG.error("Task %s failed: %s" % (task['name'], e))
+
+        used = monotonic() - start
+        if used > task['interval'] * self.tick:
+            task_obj.LOG.warn("Task %s took %.3fs, over its interval %.3fs, the tasks on the same worker are delayed!" % (
+                task['name'], used, task['interval'] * self.tick))
+
+        task['run_times'] -= 1
+        if task['run_times'] <= 0:
+            task_obj.LOG.info("stop task:%s" % (task['name']))
+            task['state'] = 'inactive'
+        elif task['state'] == 'active':
+            # next due is based on the last due, callback time does not drift
+            due = task['due'] + task['interval'] * self.tick
+            self.schedule(task_obj, task, max(due, monotonic()))
+
+
+scheduler_lock = threading.Lock()
+scheduler = None
+task_counter = itertools.count()
+
+
+@common_APIs.need_add_lock(scheduler_lock)
+def get_scheduler():
+    global scheduler
+    if scheduler is None:
+        scheduler = TaskScheduler()
+        scheduler.start()
+    return scheduler
+
+
 class Task():
     def __init__(self, name='default-task', logger=None):
         self.tasks = {}
@@ -29,6 +173,9 @@ class Task():
         else:
             self.LOG = MyLogger(name + '.log', clevel=logging.DEBUG)
         self.need_stop = False
+        self.active = False
+        self.index = next(task_counter)
+        self.scheduler = get_scheduler()
 
     def stop(self):
         self.need_stop = True
@@ -43,21 +190,27 @@ class Task():
                            (name, int(run_times), int(interval)))
         self.LOG.info("To add task: %s, run_times: %d, internal: %d" %
                       (name, int(run_times), int(interval)))
+        if name in self.tasks:
+            self.tasks[name]['state'] = 'inactive'
         self.tasks[name] = {
             'func': func,
             'run_times': int(run_times),
             'interval': int(interval),
-            'now_seconds': 0,
+            'due': 0,
             'argv': argv,
             'state': 'active',
             'name': name
         }
+        if self.active:
+            self.scheduler.schedule(self, self.tasks[name], monotonic(
+            ) + self.tasks[name]['interval'] * self.scheduler.tick)
         self.lock.release()
 
     def del_task(self, name):
         self.lock.acquire()
         self.LOG.warn("To delete task:%s" % (name))
         if name in self.tasks:
+            self.tasks[name]['state'] = 'inactive'
             del self.tasks[name]
         self.lock.release()
 
@@ -71,49 +224,29 @@ class Task():
         else:
             self.LOG.warn("No task...")
 
-    def task_proc(self):
-        while self.need_stop == False:
-            if len(self.tasks) == 0:
-                self.LOG.debug("No task!\n")
+    def call(self, task):
+        if callable(task['func']):
+            task['func'](*(task['argv']))
+        elif callable(eval(task['func'])):
+            eval(task['func'] + '(*' + str(task['argv']) + ')')
+        else:
+            self.LOG.error("Uncallable task: %s, will disable it!" %
+                           (task['name']))
+            task['state'] = 'inactive'
 
-            '''
-            for task in self.tasks:
-                if self.tasks[task]['state'] == 'inactive':
-                    self.del_task(task)
-            '''
-            try:
-                self.lock.acquire()
-                for task in self.tasks:
-                    if self.tasks[task]['state'] != 'active':
-                        continue
-                    self.tasks[task]['now_seconds'] += 1
-                    if self.tasks[task]['now_seconds'] >= self.tasks[task]['interval']:
-                        if callable(self.tasks[task]['func']):
-                            # self.LOG.info("It is time to run %s: " % (
-                            #    task) + self.tasks[task]['func'].__name__ + str(self.tasks[task]['argv']))
-                            self.tasks[task]['func'](
-                                *(self.tasks[task]['argv']))
-                        elif callable(eval(self.tasks[task]['func'])):
-                            # self.LOG.info("It is time to run %s: " % (
-                            #    task) + self.tasks[task]['func'] + str(self.tasks[task]['argv']))
-                            eval(self.tasks[task]['func'] + '(*' +
-                                 str(self.tasks[task]['argv']) + ')')
-                        else:
-                            self.LOG.error(
-                                "Uncallable task: %s, will disable it!")
-                            self.tasks[task]['state'] = 'inactive'
-                        self.tasks[task]['now_seconds'] = 0
-                        self.tasks[task]['run_times'] -= 1
-                        if self.tasks[task]['run_times'] == 0:
-                            self.LOG.info("stop task:%s" % (task))
-                            self.tasks[task]['state'] = 'inactive'
-                    else:
-                        pass
-                self.lock.release()
-                time.sleep(0.01)
-
-            except RuntimeError:
-                pass
+    # tasks run in the shared scheduler, here only hand them over
+    def task_proc(self):
+        self.lock.acquire()
+        if len(self.tasks) == 0:
+            self.LOG.debug("No task!\n")
+        self.active = True
+        now = monotonic()
+        for name in self.tasks:
+            task = self.tasks[name]
+            if task['state'] == 'active':
+                self.scheduler.schedule(
+                    self, task, now + task['interval'] * self.scheduler.tick)
+        self.lock.release()
 
 
 if __name__ == '__main__':
@@ -125,3 +258,5 @@ if __name__ == '__main__':
     task_sche.add_task('show task', task_sche.show_tasks, 100, 2)
     task_sche.show_tasks()
     task_sche.task_proc()
+    while True:
+        clock.sleep(1)
@@ -16,6 +16,16 @@ from abc import ABCMeta, abstractmethod
 import serial
 import serial.tools.list_ports
 
+import basic.clock as clock
+from connections.virtual_serial import VirtualSerial, is_virtual
+
+# 'pty' or 'pty:/tmp/ttyV0': connections.virtual_serial, no hardware needed
+def get_serial(port=None, baudrate=9600, logger=None):
+    if is_virtual(port):
+        return VirtualSerial(port, baudrate, logger)
+    return MySerial(port, baudrate, logger)
+
+
 # serial comm class
 
 
@@ -107,6 +117,10 @@ class MySerial():
         else:
             return False
 
+    # POSIX only, for connections.serial_engine
+    def fileno(self):
+        return self.com.fileno()
+
     def readn(self, n=1):
         return self.com.read(n)
 
@@ -170,7 +184,7 @@ class Robot():
         return
         for i in range(open_close_time):
             self.open()
-            time.sleep(1.5)
+            clock.sleep(1.5)
 
 
 class Wifi():
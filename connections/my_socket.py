@@ -6,6 +6,7 @@
 """
 
 import datetime
+import errno
 import os
 import random
 import re
@@ -14,24 +15,36 @@ import socket
 import sys
 import threading
 import time
+from collections import deque
+from itertools import islice
 
 import APIs.common_APIs as common_APIs
-from APIs.common_APIs import protocol_data_printB
+from APIs.common_APIs import HexDump
 from basic.log_tool import MyLogger
 
 try:
     import queue as Queue
 except:
     import Queue
+try:
+    import selectors
+except ImportError:
+    selectors = None
 if sys.getdefaultencoding() != 'utf-8':
     reload(sys)
     sys.setdefaultencoding('utf-8')
 
 BUFF_SIZE = 512
+IOV_MAX = 64
+DEFAULT_ACK = b'\x48\x44\x58\x4d\x30\x30\x30\x30\x30\x30\x30\x30\x30\x30\x30\x30\x30\x30\x30\x30\x30\x30\x30\x30\x31\x32\x33\x34\x35\x36\x37\x38\x39\x30\x31\x32\x33\x34\x35\x36\x37\x38\x39\x30\x01\x00\x00\x00\x01\x00\x00\x00\x29\x00\x00\x8f\x20\x7b\x22\x52\x65\x73\x75\x6c\x74\x22\x3a\x30\x2c\x22\x43\x6f\x6d\x6d\x61\x6e\x64\x22\x3a\x22\x43\x4f\x4d\x5f\x44\x45\x56\x5f\x52\x45\x47\x49\x53\x54\x45\x52\x22\x7d'
 
 
 class MyServer:
-    def __init__(self, addr, logger, debug=False, singlethread=True, printB=True):
+    # mode: select, or selector(epoll/kqueue, per client out buffers and
+    # write-readiness driven flushes, queue_out is not used)
+    # responder: reply the decoded frames(protocol.platform_responder), or
+    # DEFAULT_ACK for every recv
+    def __init__(self, addr, logger, debug=False, singlethread=True, printB=True, mode='select', responder=None):
         server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server.setblocking(False)
         server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -49,10 +62,29 @@ class MyServer:
         self.inputs = [server]
         self.conn_to_addr = {}
 
+        self.responder = responder
+        self.mode = mode
+        if mode == 'selector':
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(server, selectors.EVENT_READ)
+
     def get_client_count(self):
         return len(self.clients)
 
+    def get_rsps(self, addr, data):
+        if self.responder:
+            return self.responder.feed(addr, data)
+        return [DEFAULT_ACK]
+
+    def drop_client(self, addr):
+        del self.clients[addr]
+        if self.responder:
+            self.responder.drop(addr)
+
     def run_forever(self, *arg):
+        if self.mode == 'selector':
+            return self.selector_loop()
+
         BUFF_SIZE = 1024
         timeout = 1
 
@@ -72,7 +104,6 @@ class MyServer:
                                 "Get connection from: " + client_address[0])
                             self.clients[client_address] = {
                                 'conn': connection,
-                                'queue_in': Queue.Queue(),
                                 'queue_out': Queue.Queue(),
                             }
                             self.inputs.append(connection)
@@ -87,13 +118,9 @@ class MyServer:
                         try:
                             data = conn.recv(BUFF_SIZE)
                             if data:
-                                self.clients[self.conn_to_addr[conn]
-                                             ]['queue_in'].put(data)
-
-                                dmsg = b'\x48\x44\x58\x4d\x30\x30\x30\x30\x30\x30\x30\x30\x30\x30\x30\x30\x30\x30\x30\x30\x30\x30\x30\x30\x31\x32\x33\x34\x35\x36\x37\x38\x39\x30\x31\x32\x33\x34\x35\x36\x37\x38\x39\x30\x01\x00\x00\x00\x01\x00\x00\x00\x29\x00\x00\x8f\x20\x7b\x22\x52\x65\x73\x75\x6c\x74\x22\x3a\x30\x2c\x22\x43\x6f\x6d\x6d\x61\x6e\x64\x22\x3a\x22\x43\x4f\x4d\x5f\x44\x45\x56\x5f\x52\x45\x47\x49\x53\x54\x45\x52\x22\x7d'
-
-                                self.clients[self.conn_to_addr[conn]
-                                             ]['queue_out'].put(dmsg)
+                                for rsp in self.get_rsps(self.conn_to_addr[conn], data):
+                                    self.clients[self.conn_to_addr[conn]
+                                                 ]['queue_out'].put(rsp)
 
                                 if isinstance(data, type(b'')):
                                     tmp_data = data
@@ -102,7 +129,7 @@ class MyServer:
 
                                 if self.debug:
                                     if self.printB:
-                                        self.LOG.info(protocol_data_printB(
+                                        self.LOG.info(HexDump(
                                             tmp_data, title="Get data from " + self.conn_to_addr[conn][0] + ":"))
                                     else:
                                         self.LOG.info(
@@ -114,7 +141,7 @@ class MyServer:
                                 self.clients[self.conn_to_addr[conn]
                                              ]['conn'].close()
                                 self.inputs.remove(conn)
-                                del self.clients[self.conn_to_addr[conn]]
+                                self.drop_client(self.conn_to_addr[conn])
                                 del self.conn_to_addr[conn]
 
                         except socket.error:
@@ -123,7 +150,7 @@ class MyServer:
                             self.clients[self.conn_to_addr[conn]
                                          ]['conn'].close()
                             self.inputs.remove(conn)
-                            del self.clients[self.conn_to_addr[conn]]
+                            self.drop_client(self.conn_to_addr[conn])
                             del self.conn_to_addr[conn]
 
                 if self.singlethread:
@@ -146,6 +173,166 @@ class MyServer:
             self.LOG.info("socket server end!")
             sys.exit(0)
 
+    def selector_loop(self):
+        BUFF_SIZE = 1024
+        timeout = 1
+
+        try:
+            while True:
+                if self.debug:
+                    self.LOG.debug(
+                        "Waiting for next event, now has active clients: %d" % (len(self.clients)))
+                pending = set()
+                for key, mask in self.selector.select(timeout):
+                    conn = key.fileobj
+                    if conn == self.server:
+                        self.accept_client()
+                        continue
+
+                    if mask & selectors.EVENT_READ:
+                        try:
+                            data = conn.recv(BUFF_SIZE)
+                        except socket.error as e:
+                            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                                continue
+                            self.LOG.error("Get data from %s falied!" %
+                                           (self.conn_to_addr[conn][0]))
+                            self.close_client(conn)
+                            continue
+
+                        if data:
+                            self.handle_data(conn, data)
+                            pending.add(conn)
+                        else:
+                            # Interpret empty result as closed connection
+                            self.LOG.error(
+                                self.conn_to_addr[conn][0] + ' closed!')
+                            self.close_client(conn)
+                            continue
+
+                    if mask & selectors.EVENT_WRITE:
+                        pending.add(conn)
+
+                # all frames queued in this round go out together
+                for conn in pending:
+                    if conn in self.conn_to_addr:
+                        self.flush(conn)
+
+        except KeyboardInterrupt:
+            self.LOG.info(
+                'KeyboardInterrupt, now to close all clinets and server!')
+            for client in self.clients:
+                self.clients[client]['conn'].close()
+            self.server.close()
+
+        except Exception as e:
+            self.LOG.error(str(e))
+            for client in self.clients:
+                self.clients[client]['conn'].close()
+            self.server.close()
+
+        finally:
+            self.LOG.info("socket server end!")
+            sys.exit(0)
+
+    def accept_client(self):
+        try:
+            connection, client_address = self.server.accept()
+        except socket.error as e:
+            self.LOG.error("Get connection falied![%s]" % (e))
+            return
+
+        connection.setblocking(0)
+        self.LOG.info("Get connection from: " + client_address[0])
+        self.clients[client_address] = {
+            'conn': connection,
+            'queue_out': Queue.Queue(),
+            'out_frames': deque(),
+            'out_buf': bytearray(),
+            'writing': False,
+        }
+        self.conn_to_addr[connection] = client_address
+        self.selector.register(connection, selectors.EVENT_READ)
+
+    def close_client(self, conn):
+        self.selector.unregister(conn)
+        conn.close()
+        self.drop_client(self.conn_to_addr[conn])
+        del self.conn_to_addr[conn]
+
+    def handle_data(self, conn, data):
+        if self.debug:
+            if self.printB:
+                self.LOG.info(HexDump(
+                    data, title="Get data from " + self.conn_to_addr[conn][0] + ":"))
+            else:
+                self.LOG.info(
+                    "Get data from " + self.conn_to_addr[conn][0] + ": " + data.decode('utf-8'))
+        for rsp in self.get_rsps(self.conn_to_addr[conn], data):
+            self.add_frame(conn, rsp)
+
+    def add_frame(self, conn, data):
+        if not isinstance(data, type(b'')):
+            data = data.encode('utf-8')
+        if self.debug:
+            if self.printB:
+                self.LOG.yinfo(HexDump(
+                    data, title="Send data to " + self.conn_to_addr[conn][0] + ":"))
+            else:
+                self.LOG.yinfo(
+                    "Send data to " + self.conn_to_addr[conn][0] + ": " + data.decode('utf-8'))
+        self.clients[self.conn_to_addr[conn]]['out_frames'].append(data)
+
+    def consume(self, client, sent):
+        out_buf = client['out_buf']
+        if out_buf:
+            if sent < len(out_buf):
+                del out_buf[:sent]
+                return
+            sent -= len(out_buf)
+            del out_buf[:]
+
+        out_frames = client['out_frames']
+        while sent and out_frames:
+            frame = out_frames.popleft()
+            if sent < len(frame):
+                out_buf += memoryview(frame)[sent:]
+                return
+            sent -= len(frame)
+
+    def flush(self, conn):
+        client = self.clients[self.conn_to_addr[conn]]
+        while client['out_buf'] or client['out_frames']:
+            iov = []
+            if client['out_buf']:
+                iov.append(client['out_buf'])
+            iov.extend(islice(client['out_frames'], 0, IOV_MAX - len(iov)))
+            size = sum(len(item) for item in iov)
+            try:
+                if hasattr(conn, 'sendmsg'):
+                    sent = conn.sendmsg(iov)
+                else:
+                    sent = conn.send(b''.join([bytes(item) for item in iov]))
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                self.LOG.error(
+                    self.conn_to_addr[conn][0] + ' closed! [%s]' % (str(e)))
+                self.close_client(conn)
+                return
+
+            self.consume(client, sent)
+            if sent < size:
+                break
+
+        writing = bool(client['out_buf'] or client['out_frames'])
+        if writing != client['writing']:
+            client['writing'] = writing
+            events = selectors.EVENT_READ
+            if writing:
+                events |= selectors.EVENT_WRITE
+            self.selector.modify(conn, events)
+
     def sendloop(self, *arg):
         while True:
             self.send_once()
@@ -164,7 +351,7 @@ class MyServer:
                         tmp_data = data.encode('utf-8')
                     if self.debug:
                         if self.printB:
-                            self.LOG.yinfo(protocol_data_printB(
+                            self.LOG.yinfo(HexDump(
                                 tmp_data, title="Send data to " + self.conn_to_addr[client][0] + ":"))
                         else:
                             self.LOG.yinfo(
@@ -184,7 +371,8 @@ class MyClient:
     state_lock = threading.Lock()
     conn_lock = threading.Lock()
 
-    def __init__(self, addr, logger, self_addr=None, debug=True, printB=True):
+    # recv_into: recv into one preallocated buffer(buff_size), see recv_into_once
+    def __init__(self, addr, logger, self_addr=None, debug=True, printB=True, buff_size=BUFF_SIZE, recv_into=False):
         self.client = ''
         self.addr = addr
         self.LOG = logger
@@ -194,6 +382,11 @@ class MyClient:
         self.printB = printB
         self.binded = False
         self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.buff_size = buff_size
+        self.recv_buf = None
+        if recv_into:
+            self.recv_buf = bytearray(buff_size)
+            self.recv_view = memoryview(self.recv_buf)
 
     def get_connected(self):
         return self.connected
@@ -237,7 +430,7 @@ class MyClient:
             if not (readable):
                 pass
             else:
-                data = self.client.recv(BUFF_SIZE)
+                data = self.client.recv(self.buff_size)
                 if data:
                     if self.debug:
                         if isinstance(data, type(b'')):
@@ -245,7 +438,7 @@ class MyClient:
                         else:
                             tmp_data = data.encode('utf-8')
                         if self.printB:
-                            self.LOG.info(protocol_data_printB(
+                            self.LOG.info(HexDump(
                                 tmp_data, title="client get data:"))
                         else:
                             self.LOG.info("client get data: %s" %
@@ -264,6 +457,74 @@ class MyClient:
             self.inputs.remove(self.client)
             self.set_connected(False)
 
+    # return a memoryview of the recv buffer, only valid until the next call
+    def recv_into_once(self, timeout=1):
+        try:
+            if not self.get_connected():
+                return
+            readable, writable, exceptional = select.select(
+                self.inputs, [], self.inputs, timeout)
+            if not readable:
+                return
+
+            size = self.client.recv_into(self.recv_buf)
+            if size:
+                if self.debug:
+                    self.LOG.info(HexDump(
+                        self.recv_view[:size], title="client get data:"))
+                return self.recv_view[:size]
+
+            self.LOG.error("Server maybe has closed!")
+            self.client.close()
+            self.inputs.remove(self.client)
+            self.set_connected(False)
+
+        except socket.error:
+            self.LOG.error("socket error, don't know why.")
+            self.client.close()
+            self.inputs.remove(self.client)
+            self.set_connected(False)
+
+    # sendall semantics for a list of frames, IOV_MAX frames per sendmsg
+    def sendmsg_all(self, frames):
+        iov = deque([memoryview(frame) for frame in frames if frame])
+        while iov:
+            sent = self.client.sendmsg(list(islice(iov, 0, IOV_MAX)))
+            while sent:
+                if sent < len(iov[0]):
+                    iov[0] = iov[0][sent:]
+                    break
+                sent -= len(iov.popleft())
+
+    def send_batch(self, datas):
+        try:
+            if not self.get_connected():
+                return
+            frames = []
+            for data in datas:
+                if not isinstance(data, type(b'')):
+                    data = data.encode('utf-8')
+                if self.debug:
+                    if self.printB:
+                        self.LOG.yinfo(HexDump(
+                            data, title="client send date:"))
+                    else:
+                        self.LOG.yinfo("client send data: %s" %
+                                       (data.decode('utf-8')))
+                frames.append(data)
+
+            if hasattr(self.client, 'sendmsg'):
+                self.sendmsg_all(frames)
+            else:
+                self.client.sendall(b''.join(frames))
+
+        except Exception as e:
+            self.LOG.error(
+                "send data fail, Server maybe has closed![%s]" % (str(e)))
+            self.client.close()
+            self.inputs.remove(self.client)
+            self.set_connected(False)
+
     def send_once(self, data=None):
         try:
             if not self.get_connected():
@@ -275,7 +536,7 @@ class MyClient:
 
             if self.debug:
                 if self.printB:
-                    self.LOG.yinfo(protocol_data_printB(
+                    self.LOG.yinfo(HexDump(
                         tmp_data, title="client send date:"))
                 else:
                     self.LOG.yinfo("client send data: %s" %
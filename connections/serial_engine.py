@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""serial engine
+by Kobe Gong. 2018-2-15
+use:
+    one thread for all the serial devices(Air...), instead of the
+    schedule/send/recv threads per port:
+    engine = SerialEngine(LOG)
+    engine.add_device(Air('COM1', logger=LOG))
+    engine.run_forever()
+    the port fds(MySerial.fileno) are waited with selectors(select.select on
+    py2), the recv datas go through device.data_handle in this thread and the
+    rsps in queue_out go to a per port out buffer, written without blocking
+    and the rest when the port is writable again(a port not read by its
+    peer does not hold up the others); add_send_data from other threads
+    wakes the loop by a self-pipe
+"""
+
+import errno
+import fcntl
+import os
+import select
+import threading
+
+import basic.clock as clock
+from APIs.common_APIs import HexDump
+
+try:
+    import selectors
+except ImportError:
+    selectors = None
+
+
+class SerialEngine():
+    def __init__(self, logger, timeout=1, retry_interval=1):
+        self.LOG = logger
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.lock = threading.Lock()
+        self.devices = {}
+        # fd: datas not written yet
+        self.out_bufs = {}
+        # not open yet or lost: opened again from the loop
+        self.closed_devices = []
+        self.notified = set()
+        self.need_stop = False
+        self.next_retry = 0
+
+        self.wake_r, self.wake_w = os.pipe()
+        self.set_nonblocking(self.wake_r)
+        self.set_nonblocking(self.wake_w)
+        if selectors:
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(self.wake_r, selectors.EVENT_READ)
+        else:
+            self.selector = None
+
+    def set_nonblocking(self, fd):
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(
+            fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    def add_device(self, device):
+        device.send_notify = lambda: self.notify(device)
+        with self.lock:
+            self.closed_devices.append(device)
+        self.wakeup()
+
+    def notify(self, device):
+        with self.lock:
+            self.notified.add(device)
+        self.wakeup()
+
+    def wakeup(self):
+        try:
+            os.write(self.wake_w, b'\x00')
+        except OSError:
+            # pipe full, the loop is awake anyway
+            pass
+
+    def open_devices(self):
+        if clock.monotonic() < self.next_retry:
+            return
+        with self.lock:
+            devices, self.closed_devices = self.closed_devices, []
+        failed = []
+        for device in devices:
+            if device.connection_setup():
+                fd = device.connection.fileno()
+                self.devices[fd] = device
+                self.out_bufs[fd] = bytearray()
+                if self.selector:
+                    self.selector.register(fd, selectors.EVENT_READ)
+            else:
+                failed.append(device)
+        if failed:
+            self.next_retry = clock.monotonic() + self.retry_interval
+            with self.lock:
+                self.closed_devices.extend(failed)
+
+    def close_device(self, fd):
+        device = self.devices.pop(fd)
+        del self.out_bufs[fd]
+        if self.selector:
+            self.selector.unregister(fd)
+        device.connection.close()
+        device.left_data = device.left_data[:0]
+        with self.lock:
+            self.closed_devices.append(device)
+
+    # readable fds, writable fds
+    def wait(self):
+        if self.selector:
+            readable, writable = [], []
+            for key, mask in self.selector.select(self.timeout):
+                if mask & selectors.EVENT_READ:
+                    readable.append(key.fd)
+                if mask & selectors.EVENT_WRITE:
+                    writable.append(key.fd)
+            return readable, writable
+        readable, writable, exceptional = select.select(
+            [self.wake_r] + list(self.devices), [fd for fd in self.out_bufs if self.out_bufs[fd]], [], self.timeout)
+        return readable, writable
+
+    def flush(self, fd):
+        device = self.devices[fd]
+        out_buf = self.out_bufs[fd]
+        pending = bool(out_buf)
+        while not device.queue_out.empty():
+            data = device.queue_out.get_nowait()
+            if not isinstance(data, (type(b''), bytearray)):
+                data = data.encode('utf-8')
+            device.LOG.yinfo(HexDump(data, title=device.port + " send data:"))
+            out_buf += data
+
+        # the port fds are non-blocking(pyserial opens them so too)
+        while out_buf:
+            try:
+                sent = os.write(fd, out_buf)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            del out_buf[:sent]
+
+        if self.selector and bool(out_buf) != pending:
+            events = selectors.EVENT_READ
+            if out_buf:
+                events |= selectors.EVENT_WRITE
+            self.selector.modify(fd, events)
+
+    def run_forever(self):
+        while self.need_stop == False:
+            self.open_devices()
+            fds, writable = self.wait()
+            handled = set(writable)
+            for fd in fds:
+                if fd == self.wake_r:
+                    try:
+                        while os.read(self.wake_r, 4096):
+                            pass
+                    except OSError:
+                        pass
+                    continue
+
+                device = self.devices.get(fd)
+                if device is None:
+                    continue
+                try:
+                    datas = device.recv_data()
+                except Exception as e:
+                    self.LOG.error('%s read failed: %s' % (device.name, e))
+                    self.close_device(fd)
+                    continue
+                if datas:
+                    device.data_handle(datas)
+                    handled.add(fd)
+
+            with self.lock:
+                notified, self.notified = self.notified, set()
+            if notified:
+                handled |= set([fd for fd, device in self.devices.items()
+                                if device in notified])
+            # timeout: queue_out may be put without notify
+            if not fds and not writable:
+                handled = set(self.devices)
+            for fd in handled:
+                if fd not in self.devices:
+                    continue
+                try:
+                    self.flush(fd)
+                except Exception as e:
+                    self.LOG.error('%s write failed: %s' % (self.devices[fd].name, e))
+                    self.close_device(fd)
+
+    def stop(self):
+        self.need_stop = True
+        self.wakeup()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""virtual serial
+by Kobe Gong. 2018-2-16
+use:
+    port 'pty' or 'pty:/tmp/ttyV0' in place of 'COMx', no hardware needed:
+    the sim keeps the master side of a pty pair, the other end(os.ttyname of
+    the slave, or the given symlink) is for uart_bench.py or any serial tool.
+    VirtualSerial has the MySerial API, connections.my_serial.get_serial
+    picks it for the 'pty' ports
+"""
+
+import errno
+import fcntl
+import os
+import select
+import tty
+
+
+def is_virtual(port):
+    return str(port).startswith('pty')
+
+
+class VirtualSerial():
+    def __init__(self, port='pty', baudrate=9600, logger=None):
+        self.LOG = logger
+        self.port = port
+        self.baudrate = baudrate
+        self.link = port[4:] if port.startswith('pty:') else None
+        self.master = None
+        self.slave = None
+        self.peer = None
+        self.connected = False
+
+    def get_connected(self):
+        return self.connected
+
+    def set_connected(self, value):
+        self.connected = value
+
+    def open(self, need_retry=False):
+        try:
+            self.master, self.slave = os.openpty()
+            tty.setraw(self.slave)
+            fcntl.fcntl(self.master, fcntl.F_SETFL, fcntl.fcntl(
+                self.master, fcntl.F_GETFL) | os.O_NONBLOCK)
+            self.peer = os.ttyname(self.slave)
+            if self.link:
+                if os.path.lexists(self.link):
+                    os.remove(self.link)
+                os.symlink(self.peer, self.link)
+                self.peer = self.link
+        except (OSError, IOError) as er:
+            self.LOG.error('Open %s fail: %s' % (self.port, er))
+            self.close()
+            return False
+        self.LOG.info('%s: the other end is %s' % (self.port, self.peer))
+        return True
+
+    # the slave fd is kept open, or the master read gets EIO when no peer
+    def close(self):
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+        self.master = self.slave = None
+        if self.link and os.path.islink(self.link):
+            os.remove(self.link)
+        return True
+
+    def is_open(self):
+        return self.master is not None
+
+    def fileno(self):
+        return self.master
+
+    def readn(self, n=1):
+        try:
+            return os.read(self.master, n)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return b''
+            raise
+
+    def read(self):
+        return self.readn(1)
+
+    def readall(self):
+        datas = b''
+        while True:
+            data = self.readn(4096)
+            if not data:
+                return datas
+            datas += data
+
+    def send(self, data):
+        return self.write(data + b'\r')
+
+    # blocking, like the pyserial write without write_timeout
+    def write(self, data):
+        total = 0
+        while total < len(data):
+            try:
+                total += os.write(self.master, data[total:])
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                select.select([], [self.master], [], 1)
+        return total
@@ -12,6 +12,7 @@ import datetime
 import decimal
 import json
 import logging
+import multiprocessing
 import os
 import random
 import re
@@ -30,8 +31,9 @@ import APIs.common_APIs as common_APIs
 from APIs.common_APIs import (my_system, my_system_full_output,
                               my_system_no_check, protocol_data_printB)
 from basic.cprint import cprint
-from basic.log_tool import MyLogger
+from basic.log_tool import LogPipeline, MyLogger
 from basic.task import Task
+from connections.my_socket import BUFF_SIZE
 from protocol.light_devices import Door
 
 if sys.getdefaultencoding() != 'utf-8':
@@ -96,6 +98,44 @@ class ArgHandle():
             type=int,
             help='Specify how many devices to start, default is only 1',
         )
+        parser.add_argument(
+            '--engine',
+            dest='engine',
+            action='store',
+            choices=['thread', 'asyncio'],
+            default='thread',
+            help='Specify how to drive the devices: 4 threads per device or one shared asyncio loop, default is thread',
+        )
+        parser.add_argument(
+            '--log-files',
+            dest='log_files',
+            action='store',
+            default=4,
+            type=int,
+            help='Specify how many log files the devices share if count big than 1, default is 4',
+        )
+        parser.add_argument(
+            '--processes',
+            dest='processes',
+            action='store',
+            default=1,
+            type=int,
+            help='Specify how many worker processes to share the devices, default is 1',
+        )
+        parser.add_argument(
+            '--buff-size',
+            dest='buff_size',
+            action='store',
+            default=BUFF_SIZE,
+            type=int,
+            help='Specify socket recv buffer size, default is %d' % (BUFF_SIZE),
+        )
+        parser.add_argument(
+            '--inline',
+            dest='inline',
+            action='store_true',
+            help='recv_into a preallocated buffer and frame the data in the recv loop',
+        )
         return parser
 
     def get_args(self, attrname):
@@ -135,28 +175,47 @@ class ArgHandle():
 
 
 class MyCmd(Cmd):
-    def __init__(self, logger, sim_objs=None):
+    # workers: [(process, pipe)], the commands fan out to every worker
+    def __init__(self, logger, sim_objs=None, workers=None):
         Cmd.__init__(self)
         self.prompt = "SIM>"
         self.sim_objs = sim_objs
+        self.workers = workers
         self.LOG = logger
 
+    def run_cmd(self, cmd, arg=''):
+        if self.workers:
+            results = []
+            dead = []
+            for worker, conn in self.workers:
+                try:
+                    conn.send((cmd, arg))
+                except (EOFError, OSError, IOError) as e:
+                    dead.append((worker, conn, e))
+            for worker, conn in self.workers:
+                if worker in [item[0] for item in dead]:
+                    continue
+                try:
+                    results.append(conn.recv())
+                except (EOFError, OSError, IOError) as e:
+                    dead.append((worker, conn, e))
+            # a dead worker only takes its own devices, the others go on
+            for worker, conn, e in dead:
+                cprint.error_p("worker %s is dead[%r], its devices are dropped!" % (
+                    worker.name, e))
+                conn.close()
+                self.workers.remove((worker, conn))
+        else:
+            results = [sims_command(self.sim_objs, cmd, arg)]
+        return merge_results(results)
+
     def help_log(self):
         cprint.notice_p(
             "change logger level: log {0:critical, 1:error, 2:warning, 3:info, 4:debug}")
 
     def do_log(self, arg, opts=None):
-        level = {
-            '0': logging.CRITICAL,
-            '1': logging.ERROR,
-            '2': logging.WARNING,
-            '3': logging.INFO,
-            '4': logging.DEBUG,
-        }
-        if int(arg) in range(5):
-            for i in self.sim_objs:
-                cprint.notice_p("=" * 40)
-                self.sim_objs[i].LOG.set_level(level[arg])
+        if arg in log_levels:
+            self.run_cmd('log', arg)
         else:
             cprint.warn_p("unknow log level: %s!" % (arg))
 
@@ -164,33 +223,41 @@ class MyCmd(Cmd):
         cprint.notice_p("show state")
 
     def do_st(self, arg, opts=None):
-        for i in self.sim_objs:
-            cprint.notice_p("-" * 20)
-            self.sim_objs[i].status_show()
+        st = self.run_cmd('st')
+        cprint.notice_p("devices: %d, registered: %d" %
+                        (st['devices'], st['registered']))
+        for command in sorted(st['msgst']):
+            cprint.notice_p("%s: req %d, rsp %d" % (
+                command, st['msgst'][command]['req'], st['msgst'][command]['rsp']))
 
     def help_record(self):
         cprint.notice_p("send record:")
 
     def do_record(self, arg, opts=None):
-        for i in self.sim_objs:
-            self.sim_objs[i].send_msg(
-                self.sim_objs[i].get_upload_record(int(arg)))
+        if not arg.isdigit():
+            cprint.warn_p("usage: record <count>")
+            return
+        self.run_cmd('record', int(arg))
 
     def help_event(self):
         cprint.notice_p("send event")
 
     def do_event(self, arg, opts=None):
-        for i in self.sim_objs:
-            self.sim_objs[i].send_msg(
-                self.sim_objs[i].get_upload_event(int(arg)))
+        if not arg.isdigit():
+            cprint.warn_p("usage: event <count>")
+            return
+        self.run_cmd('event', int(arg))
 
     def help_set(self):
         cprint.notice_p("set state")
 
+    # checked here, a bad command must not reach(and kill) the workers
     def do_set(self, arg, opts=None):
         args = arg.split()
-        for i in self.sim_objs:
-            self.sim_objs[i].set_item(args[0], args[1])
+        if len(args) != 2:
+            cprint.warn_p("usage: set <item> <value>")
+            return
+        self.run_cmd('set', args)
 
     def default(self, arg, opts=None):
         try:
@@ -206,10 +273,120 @@ class MyCmd(Cmd):
 
     def do_exit(self, arg, opts=None):
         cprint.notice_p("Exit CLI, good luck!")
+        if self.workers:
+            for worker, conn in self.workers:
+                try:
+                    conn.send(('exit', ''))
+                except (EOFError, OSError, IOError):
+                    pass
+            for worker, conn in self.workers:
+                worker.join()
         sys_cleanup()
         sys.exit()
 
 
+log_levels = {
+    '0': logging.CRITICAL,
+    '1': logging.ERROR,
+    '2': logging.WARNING,
+    '3': logging.INFO,
+    '4': logging.DEBUG,
+}
+
+
+def sims_command(sims, cmd, arg):
+    for i in sims:
+        if cmd == 'st':
+            sims[i].LOG.warn("-" * 20)
+            sims[i].status_show()
+        elif cmd == 'log':
+            sims[i].LOG.set_level(log_levels[arg])
+        elif cmd == 'record':
+            sims[i].send_msg(sims[i].get_upload_record(arg))
+        elif cmd == 'event':
+            sims[i].send_msg(sims[i].get_upload_event(arg))
+        elif cmd == 'set':
+            sims[i].set_item(arg[0], arg[1])
+
+    msgst = defaultdict(lambda: {'req': 0, 'rsp': 0})
+    for i in sims:
+        for command, st in list(sims[i].msgst.items()):
+            msgst[command]['req'] += st['req']
+            msgst[command]['rsp'] += st['rsp']
+    return {
+        'devices': len(sims),
+        'registered': len([i for i in sims if sims[i].dev_register]),
+        'msgst': dict(msgst),
+    }
+
+
+def merge_results(results):
+    st = {'devices': 0, 'registered': 0, 'msgst': {}}
+    for result in results:
+        st['devices'] += result['devices']
+        st['registered'] += result['registered']
+        for command in result['msgst']:
+            msgst = st['msgst'].setdefault(command, {'req': 0, 'rsp': 0})
+            msgst['req'] += result['msgst'][command]['req']
+            msgst['rsp'] += result['msgst'][command]['rsp']
+    return st
+
+
+# args: the parsed cmd line, passed in(not the globals), workers use it too
+def create_sims(args, ipv4_list, indexes, log_pipeline=None):
+    sims = {}
+    if args.device_count > 1:
+        log_level = logging.WARN
+    else:
+        log_level = logging.INFO
+    for i in indexes:
+        dev_LOG = MyLogger('dev_sim_%d.log' % (i), clevel=log_level,
+                           pipeline=log_pipeline, dev_index=i)
+
+        self_addr = (ipv4_list[i], random.randint(args.server_port, 65535))
+        sim = Door(logger=dev_LOG, config_file=args.config_file, server_addr=(
+            args.server_IP, args.server_port), self_addr=self_addr, N=i,
+            buff_size=args.buff_size, inline=args.inline)
+        sim.run_forever(engine=args.engine)
+        sims[i] = sim
+    return sims
+
+
+# worker process: own the devices of indexes, serve the MyCmd commands on
+# conn; everything comes in the arguments, works with fork and spawn
+def worker_proc(index, args, ipv4_list, indexes, conn):
+    log_pipeline = None
+    if len(indexes) > 1:
+        log_pipeline = LogPipeline(
+            'dev_sim_p%d_group' % (index), files=args.log_files)
+        log_pipeline.start()
+    sims = create_sims(args, ipv4_list, indexes, log_pipeline)
+
+    while True:
+        try:
+            cmd, arg = conn.recv()
+        except EOFError:
+            break
+        if cmd == 'exit':
+            break
+        conn.send(sims_command(sims, cmd, arg))
+    if log_pipeline:
+        log_pipeline.stop()
+
+
+def start_workers(count):
+    workers = []
+    indexes = list(range(arg_handle.get_args('device_count')))
+    for k in range(count):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        worker = multiprocessing.Process(target=worker_proc, args=(
+            k, arg_handle.args, ipv4_list, indexes[k::count], child_conn))
+        worker.daemon = True
+        worker.start()
+        workers.append((worker, parent_conn))
+    return workers
+
+
 def sys_proc(action="default"):
     global thread_ids
     thread_ids = []
@@ -233,6 +410,8 @@ def sys_init():
 
 def sys_cleanup():
     LOG.info("Goodbye!!!")
+    if log_pipeline:
+        log_pipeline.stop()
 
 
 if __name__ == '__main__':
@@ -249,32 +428,29 @@ if __name__ == '__main__':
     thread_list = []
 
     sims = {}
-    if arg_handle.get_args('device_count') > 1:
-        log_level = logging.WARN
+    workers = None
+    log_pipeline = None
+    if arg_handle.get_args('processes') > 1:
+        workers = start_workers(arg_handle.get_args('processes'))
     else:
-        log_level = logging.INFO
-    for i in range(arg_handle.get_args('device_count')):
-        dev_LOG = MyLogger('dev_sim_%d.log' % (i), clevel=log_level)
-
-        self_addr = (ipv4_list[i], random.randint(
-            arg_handle.get_args('server_port'), 65535))
-        sim = Door(logger=dev_LOG, config_file=arg_handle.get_args('config_file'), server_addr=(
-            arg_handle.get_args('server_IP'), arg_handle.get_args('server_port')), self_addr=self_addr, N=i)
-        # thread_list.append([sim.run_forever])
-        sim.run_forever()
-        sims[i] = sim
+        if arg_handle.get_args('device_count') > 1:
+            log_pipeline = LogPipeline(
+                'dev_sim_group', files=arg_handle.get_args('log_files'))
+            log_pipeline.start()
+        sims = create_sims(arg_handle.args, ipv4_list,
+                           range(arg_handle.get_args('device_count')), log_pipeline)
 
     sys_proc()
 
-    if arg_handle.get_args('debug'):
+    if arg_handle.get_args('debug') and sims:
         dmsg = b''
         time.sleep(1)
-        sim.sdk_obj.queue_in.put(dmsg)
+        sims[0].sdk_obj.queue_in.put(dmsg)
 
     if True:
         # signal.signal(signal.SIGINT, lambda signal,
         #              frame: cprint.notice_p('Exit SYSTEM: exit'))
-        my_cmd = MyCmd(logger=LOG, sim_objs=sims)
+        my_cmd = MyCmd(logger=LOG, sim_objs=sims, workers=workers)
         my_cmd.cmdloop()
 
     else:
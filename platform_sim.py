@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""platform sim, local stand-in of the cloud platform for dev_sim
+by Kobe Gong. 2018-2-11
+"""
+
+import argparse
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+from cmd import Cmd
+
+import connections.my_socket as my_socket
+from basic.cprint import cprint
+from basic.log_tool import MyLogger
+from protocol.platform_responder import HDXMResponder
+
+
+class ArgHandle():
+    def __init__(self):
+        self.parser = self.build_option_parser("-" * 50)
+
+    def build_option_parser(self, description):
+        parser = argparse.ArgumentParser(description=description)
+        parser.add_argument(
+            '-d', '--debug',
+            dest='debug',
+            action='store_true',
+            help='debug switch',
+        )
+        parser.add_argument(
+            '-p', '--server-port',
+            dest='server_port',
+            action='store',
+            default=20001,
+            type=int,
+            help='Specify TCP server port',
+        )
+        parser.add_argument(
+            '-i', '--server-IP',
+            dest='server_IP',
+            action='store',
+            default='0.0.0.0',
+            help='Specify TCP server IP address',
+        )
+        parser.add_argument(
+            '--mode',
+            dest='mode',
+            action='store',
+            choices={'select', 'selector'},
+            default='selector',
+            help='Specify server io mode',
+        )
+        return parser
+
+    def get_args(self, attrname):
+        return getattr(self.args, attrname)
+
+    def check_args(self):
+        pass
+
+    def run(self):
+        self.args = self.parser.parse_args()
+        cprint.notice_p("CMD line: " + str(self.args))
+        self.check_args()
+
+
+class MyCmd(Cmd):
+    def __init__(self, server, responder):
+        Cmd.__init__(self)
+        self.prompt = "PLATFORM>"
+        self.server = server
+        self.responder = responder
+
+    def help_st(self):
+        cprint.notice_p("show clients and msg statistics")
+
+    def do_st(self, arg, opts=None):
+        cprint.notice_p("clients: %d" % (self.server.get_client_count()))
+        for command in sorted(self.responder.msgst):
+            cprint.notice_p("%s: req %d, rsp %d" % (
+                command, self.responder.msgst[command]['req'], self.responder.msgst[command]['rsp']))
+
+    def default(self, arg, opts=None):
+        try:
+            subprocess.call(arg, shell=True)
+        except:
+            pass
+
+    def emptyline(self):
+        pass
+
+    def help_exit(self):
+        print("Will exit")
+
+    def do_exit(self, arg, opts=None):
+        cprint.notice_p("Exit CLI, good luck!")
+        sys.exit()
+
+
+if __name__ == '__main__':
+    # sys log init
+    LOG = MyLogger(os.path.abspath(sys.argv[0]).replace('py', 'log'), clevel=logging.INFO,
+                   rlevel=logging.WARN)
+    cprint = cprint(os.path.abspath(sys.argv[0]).replace('py', 'log'))
+
+    # cmd arg init
+    arg_handle = ArgHandle()
+    arg_handle.run()
+    if arg_handle.get_args('debug'):
+        LOG.set_level(logging.DEBUG)
+
+    responder = HDXMResponder(LOG)
+    server = my_socket.MyServer((arg_handle.get_args('server_IP'), arg_handle.get_args('server_port')), LOG,
+                                debug=arg_handle.get_args('debug'), mode=arg_handle.get_args('mode'), responder=responder)
+    th = threading.Thread(target=server.run_forever)
+    th.setDaemon(True)
+    th.start()
+
+    # cmd loop
+    signal.signal(signal.SIGINT, lambda signal,
+                  frame: cprint.notice_p('Exit SYSTEM: exit'))
+    my_cmd = MyCmd(server, responder)
+    my_cmd.cmdloop()
+    sys.exit()
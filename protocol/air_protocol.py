@@ -19,24 +19,170 @@ from abc import ABCMeta, abstractmethod
 from collections import defaultdict
 
 import APIs.common_APIs as common_APIs
-from APIs.common_APIs import crc, protocol_data_printB
-from connections.my_serial import MySerial
+from APIs.common_APIs import HexDump, crc, protocol_data_printB
+from connections.my_serial import get_serial
 from protocol.protocol_process import communication_base
 
+coding = sys.getfilesystemencoding()
+
+
+def to_log(text):
+    # LANG=C etc.: no chinese in the locale, '?' instead of failing
+    return text.decode('utf-8').encode(coding, 'replace')
+
+
+# 命令表, 控制字(int) -> 日志(有/无两种时为(无, 有)), 要置位/清位的字, 处理函数(air, data)
+air_commands = {}
+
+
+def air_command(control, log=None, word=None, bit=0, on=True, handler=None, level='warn'):
+    if isinstance(log, tuple):
+        log = tuple([to_log(item) for item in log])
+    elif log:
+        log = to_log(log)
+    air_commands[control] = {
+        'log': log,
+        'level': level,
+        'word': word,
+        'bit': bit,
+        'on': on,
+        'handler': handler,
+    }
+
+
+# 查询, too much such msg, ignore it
+air_command(0x4d01, '查询命令', level='debug')
+air_command(0x4d02, '开机', '_WORDA', 0)
+air_command(0x4d03, '关机', '_WORDA', 0, on=False)
+air_command(0x4d04, '电加热 无', '_WORDA', 1, on=False)
+air_command(0x4d05, '电加热 有', '_WORDA', 1)
+air_command(0x4d08, '健康 无', '_WORDA', 3, on=False)
+air_command(0x4d09, '健康 有', '_WORDA', 3)
+air_command(0x4d18, '电子锁 无', '_WORDA', 15, on=False)
+air_command(0x4d19, '电子锁 有', '_WORDA', 15)
+air_command(0x4d1e, '换新风 无', '_WORDB', 0, on=False)
+air_command(0x4d1f, '换新风 有', '_WORDB', 0)
+air_command(0x4d1c, '加湿 无', '_WORDA', 6, on=False)
+air_command(0x4d1d, '加湿 有', '_WORDA', 6)
+air_command(0x4d22, ('上下摆风 无', '上下摆风 有'),
+            handler=lambda air, data: air.SOLLDH_set(UD_data=data))
+air_command(0x4d23, ('左右摆风 无', '左右摆风 有'),
+            handler=lambda air, data: air.SOLLDH_set(LR_data=data))
+air_command(0x4d24, ('全摆风 无', '全摆风 有'),
+            handler=lambda air, data: air.SOLLDH_set(UD_data=data, LR_data=data))
+# 自清洁 无: 0x4d1c 与加湿 无 冲突, 暂不支持
+air_command(0x4d26, '自清洁 有', '_WORDA', 2)
+air_command(0x4d28, '感人功能 无', '_WORDA', 12, on=False)
+air_command(0x4d27, '感人功能 有', '_WORDA', 12)
+air_command(0x5d01, handler=lambda air, data: air.TEMP_set(data, ifprint=1))
+air_command(0x5d07, handler=lambda air, data: air.WIND_set(data, ifprint=1))
+air_command(0x5d08, handler=lambda air, data: air.MODE_set(data, ifprint=1))
+air_command(0x4d0d, handler=lambda air, data: air.HUMSD_set(data, ifprint=1))
+# 组控制命令
+# TODO， 模块暂时不支持
+
+wind_logs = {
+    b'\x00\x00': to_log('风速高风'),
+    b'\x00\x01': to_log('风速中风'),
+    b'\x00\x02': to_log('风速低风'),
+    b'\x00\x03': to_log('风速自动'),
+}
+
+mode_logs = {
+    b'\x00\x00': to_log('自动模式'),
+    b'\x00\x01': to_log('制冷模式'),
+    b'\x00\x02': to_log('制热模式'),
+    b'\x00\x03': to_log('送风模式'),
+    b'\x00\x04': to_log('除湿模式'),
+}
+
+
+# 状态回复帧: ff ff 长度 00 00 00 00 00 01 02 6d 01 + 寄存器(各 1 word) + crc
+# 寄存器直接存在帧里, 写寄存器时原地改字节, 增量更新校验和
+class RegisterFile():
+    def __init__(self, names):
+        self.offsets = {}
+        for i, name in enumerate(names):
+            self.offsets[name] = 12 + 2 * i
+        self.frame = bytearray(b'\xFF\xFF' + struct.pack('B', len(names) * 2 + 10) +
+                               b'\x00\x00\x00\x00\x00\x01' + b'\x02' + b'\x6D\x01' + b'\x00' * (len(names) * 2 + 1))
+        # crc: sum(frame[2:-1]) % 0xff, see common_APIs.crc
+        self.sum = sum(self.frame[2:-1])
+        self.frame[-1] = self.sum % 0xff
+        self.cache = None
+
+    def get(self, name):
+        offset = self.offsets[name]
+        return bytes(self.frame[offset:offset + 2])
+
+    def get_int(self, name):
+        offset = self.offsets[name]
+        return (self.frame[offset] << 8) | self.frame[offset + 1]
+
+    def set_int(self, name, value):
+        offset = self.offsets[name]
+        frame = self.frame
+        self.sum += (value >> 8) + (value & 0xff) - \
+            frame[offset] - frame[offset + 1]
+        frame[offset] = value >> 8
+        frame[offset + 1] = value & 0xff
+        frame[-1] = self.sum % 0xff
+        self.cache = None
+
+    def set(self, name, word):
+        self.set_int(name, struct.unpack('>H', word)[0])
+
+    def set_bit(self, name, bit):
+        self.set_int(name, self.get_int(name) | (1 << bit))
+
+    def clear_bit(self, name, bit):
+        self.set_int(name, self.get_int(name) & ~(1 << bit))
+
+    def get_bit(self, name, bit):
+        return self.get_int(name) & (1 << bit)
+
+    # the same bytes until the next write
+    def build(self):
+        if self.cache is None:
+            self.cache = bytes(self.frame)
+        return self.cache
+
+
+def register_property(name):
+    return property(lambda self: self.registers.get(name),
+                    lambda self, word: self.registers.set(name, word))
+
+
 # 空调模拟器
 
 
 class Air(communication_base):
     state_lock = threading.Lock()
+    # 状态帧里的寄存器顺序
+    register_names = ['_TEMP', '_HHON', '_MMON', '_HHOFF', '_MMOFF', '_MODE',
+                      '_WIND', '_SOLLDH', '_WORDA', '_WORDB', '_HUMSD', '_STEMP']
+    _TEMP = register_property('_TEMP')
+    _HHON = register_property('_HHON')
+    _MMON = register_property('_MMON')
+    _HHOFF = register_property('_HHOFF')
+    _MMOFF = register_property('_MMOFF')
+    _MODE = register_property('_MODE')
+    _WIND = register_property('_WIND')
+    _SOLLDH = register_property('_SOLLDH')
+    _WORDA = register_property('_WORDA')
+    _WORDB = register_property('_WORDB')
+    _HUMSD = register_property('_HUMSD')
+    _STEMP = register_property('_STEMP')
 
     def __init__(self, port=None, baudrate=9600, logger=None):
         super(Air, self).__init__(queue_in=Queue.Queue(),
                                   queue_out=Queue.Queue(), logger=logger, left_data='', min_length=13)
         self.port = port
         self.name = port
-        self.connection = MySerial(port, baudrate, logger)
+        self.connection = get_serial(port, baudrate, logger)
         self.msg_statistics = defaultdict(int)
         self.state = 'close'
+        self.registers = RegisterFile(self.register_names)
 
         # 当前温度 1word
         self._TEMP = b'\x00\x00'
@@ -87,15 +233,13 @@ class Air(communication_base):
             if ifprint:
                 temp1 = struct.unpack('BB', word)
                 temp2 = temp1[0] * 256 + temp1[1] + 16 + 0.5
-                self.LOG.warn("设定温度".decode(
-                    'utf-8').encode(sys.getfilesystemencoding()) + ': %0.1f' % (temp2))
+                self.LOG.warn(to_log("设定温度") + ': %0.1f' % (temp2))
             self.WORDA_set_bit(5)
         else:
             if ifprint:
                 temp1 = struct.unpack('BB', word)
                 temp2 = temp1[0] * 256 + temp1[1] + 16
-                self.LOG.warn("设定温度".decode(
-                    'utf-8').encode(sys.getfilesystemencoding()) + ': %d' % (temp2))
+                self.LOG.warn(to_log("设定温度") + ': %d' % (temp2))
             self.WORDA_clear_bit(5)
         self._STEMP = word
         self._TEMP = word
@@ -104,60 +248,33 @@ class Air(communication_base):
     def SOLLDH_set(self, UD_data=None, LR_data=None):
         if UD_data:
             if self.bit_get(UD_data, 0):
-                self._SOLLDH = self.bit_set(self._SOLLDH, 0)
+                self.registers.set_bit('_SOLLDH', 0)
             else:
-                self._SOLLDH = self.bit_clear(self._SOLLDH, 0)
+                self.registers.clear_bit('_SOLLDH', 0)
 
         if LR_data:
             if self.bit_get(LR_data, 0):
-                self._SOLLDH = self.bit_set(self._SOLLDH, 1)
+                self.registers.set_bit('_SOLLDH', 1)
             else:
-                self._SOLLDH = self.bit_clear(self._SOLLDH, 1)
+                self.registers.clear_bit('_SOLLDH', 1)
 
     # 存储空调风速设置
     def WIND_set(self, word, ifprint=0):
-        if word in [b'\x00\x00', b'\x00\x01', b'\x00\x02', b'\x00\x03']:
+        if word in wind_logs:
             self._WIND = word
             if ifprint:
-                if word == b'\x00\x00':
-                    self.LOG.warn("风速高风".decode(
-                        'utf-8').encode(sys.getfilesystemencoding()))
-                elif word == b'\x00\x01':
-                    self.LOG.warn("风速中风".decode(
-                        'utf-8').encode(sys.getfilesystemencoding()))
-                elif word == b'\x00\x02':
-                    self.LOG.warn("风速低风".decode(
-                        'utf-8').encode(sys.getfilesystemencoding()))
-                else:
-                    self.LOG.warn("风速自动".decode(
-                        'utf-8').encode(sys.getfilesystemencoding()))
+                self.LOG.warn(wind_logs[word])
         else:
-            self.LOG.error("风速设置异常".decode(
-                'utf-8').encode(sys.getfilesystemencoding()))
+            self.LOG.error(to_log("风速设置异常"))
 
     # 存储空调模式设置
     def MODE_set(self, word, ifprint=0):
-        if word in [b'\x00\x00', b'\x00\x01', b'\x00\x02', b'\x00\x03', b'\x00\x04']:
+        if word in mode_logs:
             self._MODE = word
             if ifprint:
-                if word == b'\x00\x00':
-                    self.LOG.warn("自动模式".decode(
-                        'utf-8').encode(sys.getfilesystemencoding()))
-                elif word == b'\x00\x01':
-                    self.LOG.warn("制冷模式".decode(
-                        'utf-8').encode(sys.getfilesystemencoding()))
-                elif word == b'\x00\x02':
-                    self.LOG.warn("制热模式".decode(
-                        'utf-8').encode(sys.getfilesystemencoding()))
-                elif word == b'\x00\x03':
-                    self.LOG.warn("送风模式".decode(
-                        'utf-8').encode(sys.getfilesystemencoding()))
-                else:
-                    self.LOG.warn("除湿模式".decode(
-                        'utf-8').encode(sys.getfilesystemencoding()))
+                self.LOG.warn(mode_logs[word])
         else:
-            self.LOG.error("模式设置异常".decode(
-                'utf-8').encode(sys.getfilesystemencoding()))
+            self.LOG.error(to_log("模式设置异常"))
 
     # 存储空调湿度设置
     def HUMSD_set(self, word, ifprint=0):
@@ -165,28 +282,27 @@ class Air(communication_base):
         if ifprint:
             temp1 = struct.unpack('BB', word)
             temp2 = temp1[0] * 256 + temp1[1]
-            self.LOG.warn("除湿湿度".decode(
-                'utf-8').encode(sys.getfilesystemencoding()) + ': %0.1f' % (temp2))
+            self.LOG.warn(to_log("除湿湿度") + ': %0.1f' % (temp2))
 
     # 设置WORDA的某位
     def WORDA_set_bit(self, bit):
-        self._WORDA = self.bit_set(self._WORDA, bit)
+        self.registers.set_bit('_WORDA', bit)
 
     # 获取WORDA的某位
     def WORDA_get_bit(self, bit):
-        return self.bit_get(self._WORDA, bit)
+        return self.registers.get_bit('_WORDA', bit)
 
     # 清除WORDA的某位
     def WORDA_clear_bit(self, bit):
-        self._WORDA = self.bit_clear(self._WORDA, bit)
+        self.registers.clear_bit('_WORDA', bit)
 
     # 设置WORDB的某位
     def WORDB_set_bit(self, bit):
-        self._WORDB = self.bit_set(self._WORDB, bit)
+        self.registers.set_bit('_WORDB', bit)
 
     # 清除WORDB的某位
     def WORDB_clear_bit(self, bit):
-        self._WORDB = self.bit_clear(self._WORDB, bit)
+        self.registers.clear_bit('_WORDB', bit)
 
     def bit_set(self, word, bit):
         temp1 = struct.unpack('BB', word)
@@ -207,23 +323,7 @@ class Air(communication_base):
         return struct.pack('BB', temp2 >> 8, temp2 % 256)
 
     def msg_build(self):
-        data = (self._TEMP + self._HHON + self._MMON + self._HHOFF + self._MMOFF
-                + self._MODE + self._WIND + self._SOLLDH + self._WORDA + self._WORDB + self._HUMSD + self._STEMP)
-        # 固定两位 ff ff
-        answer = b'\xFF\xFF'
-        # 数据长度
-        answer += struct.pack('B', len(data) + 10)
-        # 固定格式
-        answer += b'\x00\x00\x00\x00\x00\x01'
-        # 固定字节02
-        answer += b'\x02'
-        # 控制字
-        answer += '\x6D\x01'
-        # 数据
-        answer += data
-        # CRC
-        answer += crc(answer[2:])
-        return answer
+        return self.registers.build()
 
     def update_msg_statistics(self, data):
         self.msg_statistics[data] += 1
@@ -327,187 +427,27 @@ class Air(communication_base):
         return data_list, left_data
 
     def protocol_handler(self, msg):
-        # 查询
-        if msg[10:12] == b'\x4d\x01':
-            self.LOG.debug("查询命令".decode(
-                'utf-8').encode(sys.getfilesystemencoding()))
-            # too much such msg, ignore it
-            return self.msg_build()
-            pass
-
-        # 开机
-        elif msg[10:12] == b'\x4d\x02':
-            self.LOG.warn("开机".decode(
-                'utf-8').encode(sys.getfilesystemencoding()))
-            self.WORDA_set_bit(0)
-            return self.msg_build()
-
-        # 关机
-        elif msg[10:12] == b'\x4d\x03':
-            self.LOG.warn("关机".decode(
-                'utf-8').encode(sys.getfilesystemencoding()))
-            self.WORDA_clear_bit(0)
-            return self.msg_build()
-
-        # 电加热 无
-        elif msg[10:12] == b'\x4d\x04':
-            self.LOG.warn("电加热 无".decode(
-                'utf-8').encode(sys.getfilesystemencoding()))
-            self.WORDA_clear_bit(1)
-            return self.msg_build()
-
-        # 电加热 有
-        elif msg[10:12] == b'\x4d\x05':
-            self.LOG.warn("电加热 有".decode(
-                'utf-8').encode(sys.getfilesystemencoding()))
-            self.WORDA_set_bit(1)
-            return self.msg_build()
-
-        # 健康 无
-        elif msg[10:12] == b'\x4d\x08':
-            self.LOG.warn("健康 无".decode(
-                'utf-8').encode(sys.getfilesystemencoding()))
-            self.WORDA_clear_bit(3)
-            return self.msg_build()
-
-        # 健康 有
-        elif msg[10:12] == b'\x4d\x09':
-            self.LOG.warn("健康 有".decode(
-                'utf-8').encode(sys.getfilesystemencoding()))
-            self.WORDA_set_bit(3)
-            return self.msg_build()
-
-        # 设定温度
-        elif msg[10:12] == b'\x5d\x01':
-            self.TEMP_set(msg[12:14], ifprint=1)
-            return self.msg_build()
-
-        # 电子锁 无
-        elif msg[10:12] == b'\x4d\x18':
-            self.LOG.warn("电子锁 无".decode(
-                'utf-8').encode(sys.getfilesystemencoding()))
-            self.WORDA_clear_bit(15)
-            return self.msg_build()
-
-        # 电子锁 有
-        elif msg[10:12] == b'\x4d\x19':
-            self.LOG.warn("电子锁 有".decode(
-                'utf-8').encode(sys.getfilesystemencoding()))
-            self.WORDA_set_bit(15)
-            return self.msg_build()
-
-        # 换新风 无
-        elif msg[10:12] == b'\x4d\x1e':
-            self.LOG.warn("换新风 无".decode(
-                'utf-8').encode(sys.getfilesystemencoding()))
-            self.WORDB_clear_bit(0)
-            return self.msg_build()
-
-        # 换新风 有
-        elif msg[10:12] == b'\x4d\x1f':
-            self.LOG.warn("换新风 有".decode(
-                'utf-8').encode(sys.getfilesystemencoding()))
-            self.WORDB_set_bit(0)
-            return self.msg_build()
-
-        # 加湿 无
-        elif msg[10:12] == b'\x4d\x1c':
-            self.LOG.warn("加湿 无".decode(
-                'utf-8').encode(sys.getfilesystemencoding()))
-            self.WORDA_clear_bit(6)
-            return self.msg_build()
-
-        # 加湿 有
-        elif msg[10:12] == b'\x4d\x1d':
-            self.LOG.warn("加湿 有".decode(
-                'utf-8').encode(sys.getfilesystemencoding()))
-            self.WORDA_set_bit(6)
-            return self.msg_build()
-
-        # 上下摆风
-        elif msg[10:12] == b'\x4d\x22':
-            if msg[12:14] == b'\x00\x01':
-                self.LOG.warn("上下摆风 有".decode(
-                    'utf-8').encode(sys.getfilesystemencoding()))
-            else:
-                self.LOG.warn("上下摆风 无".decode(
-                    'utf-8').encode(sys.getfilesystemencoding()))
-            self.SOLLDH_set(UD_data=msg[12:14])
-            return self.msg_build()
-
-        # 左右摆风
-        elif msg[10:12] == b'\x4d\x23':
-            if msg[12:14] == b'\x00\x01':
-                self.LOG.warn("左右摆风 有".decode(
-                    'utf-8').encode(sys.getfilesystemencoding()))
-            else:
-                self.LOG.warn("左右摆风 无".decode(
-                    'utf-8').encode(sys.getfilesystemencoding()))
-            self.SOLLDH_set(LR_data=msg[12:14])
-            return self.msg_build()
-
-        # 上下左右摆风
-        elif msg[10:12] == b'\x4d\x24':
-            if msg[12:14] == b'\x00\x01':
-                self.LOG.warn("全摆风 有".decode(
-                    'utf-8').encode(sys.getfilesystemencoding()))
-            else:
-                self.LOG.warn("全摆风 无".decode(
-                    'utf-8').encode(sys.getfilesystemencoding()))
-            self.SOLLDH_set(UD_data=msg[12:14], LR_data=msg[12:14])
-            return self.msg_build()
-
-        # 自清洁 无
-        # elif msg[10:12] == b'\x4d\x1c':
-        #    self.LOG.warn("自清洁 无".decode('utf-8').encode(sys.getfilesystemencoding()))
-        #    self.WORDA_clear_bit(6)
-        #    return self.msg_build()
-
-        # 自清洁 有
-        elif msg[10:12] == b'\x4d\x26':
-            self.LOG.warn("自清洁 有".decode(
-                'utf-8').encode(sys.getfilesystemencoding()))
-            self.WORDA_set_bit(2)
-            return self.msg_build()
-
-        # 感人功能 无
-        elif msg[10:12] == b'\x4d\x28':
-            self.LOG.warn("感人功能 无".decode(
-                'utf-8').encode(sys.getfilesystemencoding()))
-            self.WORDA_clear_bit(12)
-            return self.msg_build()
-
-        # 感人功能 有
-        elif msg[10:12] == b'\x4d\x27':
-            self.LOG.warn("感人功能 有".decode(
-                'utf-8').encode(sys.getfilesystemencoding()))
-            self.WORDA_set_bit(12)
-            return self.msg_build()
-
-        # 风速
-        elif msg[10:12] == b'\x5d\x07':
-            self.WIND_set(msg[12:14], ifprint=1)
-            return self.msg_build()
-
-        # 模式
-        elif msg[10:12] == b'\x5d\x08':
-            self.MODE_set(msg[12:14], ifprint=1)
-            return self.msg_build()
-
-        # 健康除湿湿度
-        elif msg[10:12] == b'\x4d\x0d':
-            self.HUMSD_set(msg[12:14], ifprint=1)
-            return self.msg_build()
-
-        # 组控制命令
-        # TODO， 模块暂时不支持
-
-        # others
-        else:
+        command = air_commands.get(struct.unpack('>H', msg[10:12])[0])
+        if command is None:
             self.LOG.error(protocol_data_printB(
                 msg, title='%s: invalid data:'))
             return self.msg_build()
 
+        data = msg[12:14]
+        log = command['log']
+        if isinstance(log, tuple):
+            log = log[data == b'\x00\x01']
+        if log:
+            getattr(self.LOG, command['level'])(log)
+        if command['word']:
+            if command['on']:
+                self.registers.set_bit(command['word'], command['bit'])
+            else:
+                self.registers.clear_bit(command['word'], command['bit'])
+        if command['handler']:
+            command['handler'](self, data)
+        return self.msg_build()
+
     @common_APIs.need_add_lock(state_lock)
     def connection_setup(self):
         self.LOG.warn('Try to open port %s...' % (self.port))
@@ -531,14 +471,14 @@ class Air(communication_base):
             self.LOG.error('Close connection failed!')
 
     def send_data(self, data):
-        self.LOG.yinfo(protocol_data_printB(
+        self.LOG.yinfo(HexDump(
             data, title=self.port + " send data:"))
         return self.connection.write(data)
 
     def recv_data(self):
         datas = self.connection.readall()
         if datas:
-            self.LOG.info(protocol_data_printB(
+            self.LOG.info(HexDump(
                 datas, title=self.port + " recv data:"))
         return datas
 
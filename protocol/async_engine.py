@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""asyncio engine for communication_base
+by Kobe Gong. 2018-2-6
+use:
+    one event loop per process drives all the devices, every device gets
+    recv/schedule/send/heartbeat coroutines instead of 4 threads; the
+    blocking parts(frames_handle, serial open and read/write) run in a
+    thread pool, never on the loop; the device time_delay is awaited on the
+    loop before each msg, the pool threads never sleep it
+"""
+
+import asyncio
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import APIs.common_APIs as common_APIs
+import connections.my_socket as my_socket
+from APIs.common_APIs import HexDump
+
+
+engine_lock = threading.Lock()
+engine = None
+
+
+class DeviceContext():
+    def __init__(self, dev):
+        self.dev = dev
+        # taken over from protocol_handler, see AsyncEngine.handle_frames
+        self.delay = getattr(dev, 'time_delay', 0) / 1000.0
+        dev.time_delay = 0
+        self.in_event = asyncio.Event()
+        self.out_event = asyncio.Event()
+        self.connected = asyncio.Event()
+
+
+class AsyncEngine():
+    def __init__(self, logger=None, poll_interval=0.01, workers=32):
+        self.LOG = logger
+        self.poll_interval = poll_interval
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.thread = None
+        self.devices = []
+        self.need_stop = False
+
+    def start(self):
+        if self.thread:
+            return
+        self.thread = threading.Thread(target=self.run_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def run_forever(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def stop(self):
+        self.need_stop = True
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.executor.shutdown(wait=False)
+        if self.LOG:
+            self.LOG.warn('Thread %s stoped!' % (__name__))
+
+    def get_device_count(self):
+        return len(self.devices)
+
+    def add_device(self, dev):
+        self.start()
+        self.loop.call_soon_threadsafe(self.device_setup, dev)
+
+    def device_setup(self, dev):
+        ctx = DeviceContext(dev)
+        dev.send_notify = lambda: self.loop.call_soon_threadsafe(
+            ctx.out_event.set)
+        self.devices.append(dev)
+        self.loop.create_task(self.recv_loop(ctx))
+        if dev.framer is None:
+            self.loop.create_task(self.schedule_loop(ctx))
+        self.loop.create_task(self.send_loop(ctx))
+        self.loop.create_task(self.heartbeat_loop(ctx))
+
+    # call func(arg) for every arg in args_list, one per interval(s)
+    def add_sequence(self, func, interval, args_list):
+        self.start()
+        self.loop.call_soon_threadsafe(
+            self.loop.create_task, self.sequence_loop(func, interval, args_list))
+
+    async def sequence_loop(self, func, interval, args_list):
+        for arg in args_list:
+            if self.need_stop:
+                break
+            await asyncio.sleep(interval)
+            func(arg)
+
+    def running(self, dev):
+        return self.need_stop == False and dev.need_stop == False
+
+    def run_blocking(self, func, *args):
+        return self.loop.run_in_executor(self.executor, func, *args)
+
+    async def handle_frames(self, ctx, frames):
+        dev = ctx.dev
+        if not frames:
+            return
+        if not ctx.delay:
+            await self.run_blocking(dev.frames_handle, frames)
+            return
+        for frame in frames:
+            await asyncio.sleep(ctx.delay)
+            await self.run_blocking(dev.frames_handle, [frame])
+            if not dev.queue_out.empty():
+                ctx.out_event.set()
+
+    async def connection_setup(self, dev):
+        conn = dev.connection
+        if conn.get_connected():
+            return True
+
+        if not isinstance(conn, my_socket.MyClient):
+            return await self.run_blocking(dev.connection_setup)
+
+        dev.LOG.warn('Try to connect %s...' % str(conn.addr))
+        if conn.self_addr and conn.binded == False:
+            conn.client.bind(conn.self_addr)
+            conn.binded = True
+        conn.inputs = [conn.client]
+        conn.client.setblocking(False)
+        try:
+            await self.loop.sock_connect(conn.client, conn.addr)
+        except Exception as e:
+            dev.LOG.warn("Connect to server failed[%s], wait 1s..." % (e))
+            conn.client.close()
+            conn.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            conn.binded = False
+            return False
+
+        conn.set_connected(True)
+        if dev.framer is not None:
+            dev.framer.reset()
+        dev.LOG.info('Connection setup success!')
+        return True
+
+    def connection_lost(self, dev, reason):
+        conn = dev.connection
+        dev.LOG.error(reason)
+        conn.client.close()
+        conn.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        conn.binded = False
+        conn.set_connected(False)
+
+    async def recv_once(self, dev):
+        conn = dev.connection
+        if not isinstance(conn, my_socket.MyClient):
+            datas = await self.run_blocking(dev.recv_data)
+            if not datas:
+                await asyncio.sleep(self.poll_interval)
+            return datas
+
+        try:
+            if conn.recv_buf is not None:
+                size = await self.loop.sock_recv_into(conn.client, conn.recv_buf)
+                datas = conn.recv_view[:size]
+            else:
+                datas = await self.loop.sock_recv(conn.client, conn.buff_size)
+        except (socket.error, ValueError) as e:
+            self.connection_lost(dev, "socket error: %s" % (e))
+            return None
+
+        if datas:
+            dev.LOG.debug(HexDump(datas, " recv data:"))
+        else:
+            self.connection_lost(dev, "Server maybe has closed!")
+        return datas
+
+    # all the datas in one sock_sendall
+    async def send_batch(self, dev, datas):
+        conn = dev.connection
+        if not isinstance(conn, my_socket.MyClient):
+            await self.run_blocking(dev.send_batch, datas)
+            return True
+
+        frames = []
+        for data in datas:
+            if not isinstance(data, type(b'')):
+                data = data.encode('utf-8')
+            dev.LOG.debug(HexDump(data, " send data:"))
+            frames.append(data)
+        try:
+            await self.loop.sock_sendall(conn.client, b''.join(frames))
+        except (socket.error, ValueError) as e:
+            self.connection_lost(
+                dev, "send data fail, Server maybe has closed![%s]" % (str(e)))
+            return False
+        return True
+
+    async def recv_loop(self, ctx):
+        dev = ctx.dev
+        while self.running(dev):
+            if not dev.get_connection_state():
+                ctx.connected.clear()
+                if not await self.connection_setup(dev):
+                    await asyncio.sleep(1)
+                    continue
+                ctx.connected.set()
+                ctx.out_event.set()
+
+            datas = await self.recv_once(dev)
+            if not datas:
+                continue
+            if dev.framer is not None:
+                await self.handle_frames(ctx, dev.framer.feed(datas))
+                if not dev.queue_out.empty():
+                    ctx.out_event.set()
+            else:
+                dev.queue_in.put(datas)
+                ctx.in_event.set()
+
+    async def schedule_loop(self, ctx):
+        dev = ctx.dev
+        while self.running(dev):
+            await ctx.in_event.wait()
+            ctx.in_event.clear()
+            datas = []
+            while not dev.queue_in.empty():
+                datas.append(dev.queue_in.get_nowait())
+            if datas:
+                await self.handle_frames(ctx, dev.data_frames(datas[0][:0].join(datas)))
+            if not dev.queue_out.empty():
+                ctx.out_event.set()
+
+    async def send_loop(self, ctx):
+        dev = ctx.dev
+        while self.running(dev):
+            await ctx.out_event.wait()
+            ctx.out_event.clear()
+            await ctx.connected.wait()
+            datas = []
+            while not dev.queue_out.empty():
+                datas.append(dev.queue_out.get_nowait())
+            if datas:
+                await self.send_batch(dev, datas)
+
+    async def heartbeat_loop(self, ctx, debug=True):
+        dev = ctx.dev
+        while self.running(dev):
+            if dev.get_connection_state():
+                data = dev.heartbeat_data
+                if not data:
+                    dev.LOG.debug('No need control heartbeat, I am out!')
+                    return
+
+                if isinstance(data, type(b'')):
+                    tmp_data = data.decode('utf-8')
+                else:
+                    tmp_data = data
+                if debug:
+                    dev.LOG.yinfo("send msg: " + tmp_data)
+                dev.queue_out.put(data)
+                ctx.out_event.set()
+            else:
+                dev.LOG.debug('offline?')
+            await asyncio.sleep(dev.heartbeat_interval)
+
+
+@common_APIs.need_add_lock(engine_lock)
+def get_engine(logger=None):
+    global engine
+    if engine is None:
+        engine = AsyncEngine(logger)
+        engine.start()
+    return engine
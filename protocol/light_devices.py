@@ -23,10 +23,15 @@ from collections import defaultdict
 from importlib import import_module
 
 import APIs.common_APIs as common_APIs
+import basic.clock as clock
 from APIs.common_APIs import bit_clear, bit_get, bit_set, protocol_data_printB
+from basic.fleet_store import FleetView, get_fleet
 from basic.log_tool import MyLogger
+from basic.state_store import DirtyTracker
 from basic.task import Task
+from connections.my_socket import BUFF_SIZE
 from protocol.light_protocol import SDK
+from protocol.msg_template import get_set_items, get_template
 
 if sys.getdefaultencoding() != 'utf-8':
     reload(sys)
@@ -35,7 +40,7 @@ if sys.getdefaultencoding() != 'utf-8':
 coding = sys.getfilesystemencoding()
 
 
-class BaseSim():
+class BaseSim(DirtyTracker):
     __metaclass__ = ABCMeta
     status_lock = threading.Lock()
     msgst_lock = threading.Lock()
@@ -47,6 +52,8 @@ class BaseSim():
         # state data:
         self.msgst = defaultdict(lambda: {})
         self.task_obj = None
+        # +1 for every set_item/add_item, the cached replies check it
+        self.state_version = 0
 
     @common_APIs.need_add_lock(msgst_lock)
     def update_msgst(self, command, direct):
@@ -60,10 +67,17 @@ class BaseSim():
 
         self.msgst[command][direct] += 1
 
+    def has_item(self, item):
+        return item in self.__dict__
+
+    def get_item_names(self):
+        return list(self.__dict__)
+
     @common_APIs.need_add_lock(status_lock)
     def set_item(self, item, value):
-        if item in self.__dict__:
-            self.__dict__[item] = value
+        if self.has_item(item):
+            setattr(self, item, value)
+            self.state_version += 1
         else:
             self.LOG.error("Unknow item: %s" % (item))
 
@@ -71,13 +85,14 @@ class BaseSim():
     def add_item(self, item, value):
         try:
             setattr(self, item, value)
+            self.state_version += 1
         except:
             self.LOG.error("add item fail: %s" % (item))
 
     def status_show(self):
-        for item in sorted(self.__dict__):
+        for item in sorted(self.get_item_names()):
             if item.startswith('_'):
-                self.LOG.warn("%s: %s" % (item, str(self.__dict__[item])))
+                self.LOG.warn("%s: %s" % (item, str(getattr(self, item))))
 
         self.LOG.warn('~' * 10)
         for msg_code in self.msgst:
@@ -102,12 +117,12 @@ class BaseSim():
         self.LOG.warn('Thread %s stoped!' % (__name__))
 
     def run_forever(self):
+        self.task_obj.task_proc()
         thread_list = []
         thread_list.append([self.sdk_obj.schedule_loop])
         thread_list.append([self.sdk_obj.send_data_loop])
         thread_list.append([self.sdk_obj.recv_data_loop])
         thread_list.append([self.sdk_obj.heartbeat_loop])
-        thread_list.append([self.task_obj.task_proc])
         thread_ids = []
         for th in thread_list:
             thread_ids.append(threading.Thread(target=th[0], args=th[1:]))
@@ -120,25 +135,18 @@ class BaseSim():
         pass
 
     def status_report_monitor(self):
-        need_send_report = False
-        if not hasattr(self, 'old_status'):
-            self.old_status = defaultdict(lambda: {})
-            for item in self.__dict__:
-                if item.startswith('_'):
-                    self.LOG.yinfo("need check item: %s" % (item))
-                    self.old_status[item] = copy.deepcopy(self.__dict__[item])
-
-        for item in self.old_status:
-            if self.old_status[item] != self.__dict__[item]:
-                need_send_report = True
-                self.old_status[item] = copy.deepcopy(self.__dict__[item])
-
-        if need_send_report:
+        if not self.tracking():
+            items = [item for item in self.get_item_names() if item.startswith('_')]
+            for item in items:
+                self.LOG.yinfo("need check item: %s" % (item))
+            self.track_items(items)
+
+        if self.take_dirty():
             self.send_msg(self.get_event_report())
 
 
-class Door(BaseSim):
-    def __init__(self, logger, config_file, server_addr, self_addr=None, N=0):
+class Door(FleetView, BaseSim):
+    def __init__(self, logger, config_file, server_addr, self_addr=None, N=0, buff_size=BUFF_SIZE, inline=False):
         super(Door, self).__init__(logger)
         module_name = "protocol.config.%s" % config_file
         mod = __import__(module_name)
@@ -150,7 +158,7 @@ class Door(BaseSim):
         self.N = N
         self.attribute_initialization()
         self.sdk_obj = SDK(addr=server_addr,
-                           logger=logger, time_delay=0, self_addr=self_addr)
+                           logger=logger, time_delay=0, self_addr=self_addr, buff_size=buff_size, inline=inline)
         self.sdk_obj.sim_obj = self
         self.sdk_obj.device_id = self._deviceID
         self.need_stop = False
@@ -159,16 +167,25 @@ class Door(BaseSim):
         self.task_obj = Task('Washer-task', self.LOG)
         self.dev_register = False
         self.command_list = getattr(self.sim_config, "Command_list")
+        self.rsp_cache = {}
         self.create_tasks()
 
-    def run_forever(self):
+    def run_forever(self, engine='thread'):
+        self.task_obj.task_proc()
         thread_list = []
-        thread_list.append([self.sdk_obj.schedule_loop])
-        thread_list.append([self.sdk_obj.send_data_loop])
-        thread_list.append([self.sdk_obj.recv_data_loop])
-        thread_list.append([self.sdk_obj.heartbeat_loop])
-        thread_list.append([self.task_obj.task_proc])
-        thread_list.append([self.msg_dispatch])
+        if engine == 'asyncio':
+            from protocol.async_engine import get_engine
+            async_engine = get_engine(self.LOG)
+            async_engine.add_device(self.sdk_obj)
+            async_engine.add_sequence(
+                self.dispatch_msg, self.test_msgs["interval"] / 1000.0, self.get_dispatch_msgs())
+        else:
+            if self.sdk_obj.framer is None:
+                thread_list.append([self.sdk_obj.schedule_loop])
+            thread_list.append([self.sdk_obj.send_data_loop])
+            thread_list.append([self.sdk_obj.recv_data_loop])
+            thread_list.append([self.sdk_obj.heartbeat_loop])
+            thread_list.append([self.msg_dispatch])
         thread_ids = []
         for th in thread_list:
             thread_ids.append(threading.Thread(target=th[0], args=th[1:]))
@@ -193,7 +210,7 @@ class Door(BaseSim):
         self.task_obj.add_task(
             'heartbeat', self.to_send_heartbeat, 1000000, 6000)
 
-    def msg_dispatch(self):
+    def get_dispatch_msgs(self):
         msgs = []
 
         for msg in self.test_msgs["msgs"]:
@@ -203,31 +220,36 @@ class Door(BaseSim):
         for msg in msgs:
             self.LOG.debug(msg)
 
-        count = 0
-        while self.need_stop == False and count < self.test_msgs["round"]:
-            count += 1
-            for msg in msgs:
-                time.sleep(self.test_msgs["interval"] / 1000.0)
-                tmp_msg = msg.split('.')
-                if tmp_msg[0] == 'COM_UPLOAD_DEV_STATUS':
-                    self.send_msg(self.get_upload_status())
-                elif tmp_msg[0] == 'COM_UPLOAD_RECORD':
-                    self.send_msg(self.get_upload_record(tmp_msg[-1]))
-                elif tmp_msg[0] == 'COM_UPLOAD_EVENT':
-                    self.send_msg(self.get_upload_event(tmp_msg[-1]))
-                else:
-                    self.LOG.error("Unknow msg to dispatch: %s" % (msg))
+        return msgs * self.test_msgs["round"]
+
+    def dispatch_msg(self, msg):
+        tmp_msg = msg.split('.')
+        if tmp_msg[0] == 'COM_UPLOAD_DEV_STATUS':
+            self.send_msg(self.get_upload_status())
+        elif tmp_msg[0] == 'COM_UPLOAD_RECORD':
+            self.send_msg(self.get_upload_record(tmp_msg[-1]))
+        elif tmp_msg[0] == 'COM_UPLOAD_EVENT':
+            self.send_msg(self.get_upload_event(tmp_msg[-1]))
+        else:
+            self.LOG.error("Unknow msg to dispatch: %s" % (msg))
+
+    def msg_dispatch(self):
+        for msg in self.get_dispatch_msgs():
+            if self.need_stop:
+                break
+            clock.sleep(self.test_msgs["interval"] / 1000.0)
+            self.dispatch_msg(msg)
 
     def status_maintain(self):
         for item in self.SPECIAL_ITEM:
             if "maintain" not in self.SPECIAL_ITEM[item]["use"]:
                 continue
-            if self.__dict__[item] != self.SPECIAL_ITEM[item]["init_value"]:
+            if getattr(self, item) != self.SPECIAL_ITEM[item]["init_value"]:
                 tmp_item = '_current_time_' + item
-                if '_current_time_' + item in self.__dict__:
-                    if self.__dict__[tmp_item] > 0:
-                        self.set_item(tmp_item, self.__dict__[tmp_item] - 1)
-                        if self.__dict__[tmp_item] <= 0:
+                if self.has_item(tmp_item):
+                    if getattr(self, tmp_item) > 0:
+                        self.set_item(tmp_item, getattr(self, tmp_item) - 1)
+                        if getattr(self, tmp_item) <= 0:
                             self.set_item(
                                 tmp_item, self.SPECIAL_ITEM[item]["wait_time"])
                             self.set_item(
@@ -240,20 +262,13 @@ class Door(BaseSim):
                                   self.SPECIAL_ITEM[item]["wait_time"])
 
     def status_report_monitor(self):
-        need_send_report = False
-        if not hasattr(self, 'old_status'):
-            self.old_status = defaultdict(lambda: {})
-            for item in self.__dict__:
-                if item in self.SPECIAL_ITEM and "report" in self.SPECIAL_ITEM[item]["use"]:
-                    self.LOG.yinfo("need check item: %s" % (item))
-                    self.old_status[item] = copy.deepcopy(self.__dict__[item])
-
-        for item in self.old_status:
-            if self.old_status[item] != self.__dict__[item]:
-                need_send_report = True
-                self.old_status[item] = copy.deepcopy(self.__dict__[item])
-
-        if need_send_report:
+        if not self.tracking():
+            items = [item for item in self.get_item_names() if item in self.SPECIAL_ITEM and "report" in self.SPECIAL_ITEM[item]["use"]]
+            for item in items:
+                self.LOG.yinfo("need check item: %s" % (item))
+            self.track_items(items)
+
+        if self.take_dirty():
             self.send_msg(self.get_upload_status())
 
     def to_register_dev(self):
@@ -263,12 +278,8 @@ class Door(BaseSim):
             self.LOG.debug(common_APIs.chinese_show("发送设备注册"))
             self.send_msg(json.dumps(
                 self.get_send_msg('COM_DEV_REGISTER')))
-            time.sleep(4)
-            if self.dev_register:
-                self.LOG.warn(common_APIs.chinese_show("设备已经注册"))
-            else:
-                self.LOG.error(common_APIs.chinese_show("设备注册失败"))
-                sys.exit()
+            self.task_obj.add_task(
+                'check register', self.check_register_dev, 1, 400)
 
     def to_send_heartbeat(self):
         self.send_msg(json.dumps(
@@ -317,21 +328,14 @@ class Door(BaseSim):
 
         if msg['Command'] in self.command_list:
             self.set_items(msg['Command'], msg)
-            rsp_msg = self.get_rsp_msg(msg['Command'])
             self.update_msgst(msg['Command'], 'rsp')
-            return json.dumps(rsp_msg)
+            return self.get_rsp_json(msg['Command'])
         else:
             self.LOG.warn('Unknow msg: %s!' % (msg['Command']))
             return None
 
     def get_msg_by_command(self, command):
-        command = getattr(self.sim_config, command)
-        command_str = str(command)
-        command_str = re.sub(r'\'TIMENOW\'', '"%s"' % datetime.datetime.now().strftime(
-            '%Y-%m-%d %H:%M:%S'), command_str)
-        command_str = re.sub(r'\'randint1\'', '"%s"' %
-                             random.randint(0, 1), command_str)
-        return eval(command_str.replace("'##", "").replace("##'", ""))
+        return get_template(self.sim_config, command).render(self)
 
     def get_record_list(self):
         return getattr(self.sim_config, "defined_record")
@@ -340,33 +344,42 @@ class Door(BaseSim):
         return getattr(self.sim_config, "defined_event")
 
     def get_send_msg(self, command):
-        return self.get_msg_by_command(command)['send_msg']
+        return get_template(self.sim_config, command, 'send_msg').render(self)
 
     def get_rsp_msg(self, command):
-        return self.get_msg_by_command(command)['rsp_msg']
+        return get_template(self.sim_config, command, 'rsp_msg').render(self)
+
+    # command -> (state_version, json), not for TIMENOW/randint templates
+    def get_rsp_json(self, command):
+        template = get_template(self.sim_config, command, 'rsp_msg')
+        if template.dynamic:
+            return json.dumps(template.render(self))
+
+        version, rsp_json = self.rsp_cache.get(command, (None, None))
+        if version != self.state_version:
+            rsp_json = json.dumps(template.render(self))
+            self.rsp_cache[command] = (self.state_version, rsp_json)
+        return rsp_json
 
     def set_items(self, command, msg):
-        item_dict = self.get_msg_by_command(command)['set_item']
-        for item, msg_param in item_dict.items():
-            msg_param_list = msg_param.split('.')
+        for item, msg_param_list in get_set_items(self.sim_config, command):
             tmp_msg = msg[msg_param_list[0]]
             for i in msg_param_list[1:]:
                 tmp_msg = tmp_msg[i]
             self.set_item(item, tmp_msg)
 
+    # state items live in the fleet columns of the config, Door is a view
     def attribute_initialization(self):
-        attribute_params_dict = getattr(
-            self.sim_config, "Attribute_initialization")
-        for attribute_params, attribute_params_value in attribute_params_dict.items():
-            self.add_item(attribute_params, attribute_params_value)
+        self.fleet = get_fleet(self.sim_config, "Attribute_initialization")
+        self.fleet_index = self.fleet.add_device()
 
-        self._mac = self.mac_list[self.N]
+        self.add_item('_mac', self.mac_list[self.N])
         #"_deviceID": "1005200958FCDBDA5380",
         #"_subDeviceID": "301058FCDBDA53800001",
-        self._deviceID = str(self.DeviceFacturer) + \
-            str(self.DeviceType) + self._mac.replace(":", '')
-        self._subDeviceID = str(self.subDeviceType) + \
-            self._mac.replace(":", '') + "%04d" % (self.N + 1)
+        self.add_item('_deviceID', str(self.DeviceFacturer) +
+                      str(self.DeviceType) + self._mac.replace(":", ''))
+        self.add_item('_subDeviceID', str(self.subDeviceType) +
+                      self._mac.replace(":", '') + "%04d" % (self.N + 1))
 
 
 if __name__ == '__main__':
@@ -20,8 +20,10 @@ from abc import ABCMeta, abstractmethod
 from collections import defaultdict
 
 import APIs.common_APIs as common_APIs
+import basic.clock as clock
 import connections.my_socket as my_socket
-from APIs.common_APIs import crc, crc16, protocol_data_printB
+from APIs.common_APIs import (HexDump, LazyStr, crc, crc16,
+                              protocol_data_printB)
 from protocol.protocol_process import communication_base
 
 try:
@@ -30,10 +32,81 @@ except:
     import Queue
 
 
+class HDXMFramer(object):
+    magic = b'HDXM'
+    head_length = 57
+    max_length = 1000
+
+    def __init__(self, logger=None, compact_size=4096):
+        self.LOG = logger
+        self.compact_size = compact_size
+        self.buf = bytearray()
+        self.offset = 0
+
+    def reset(self):
+        del self.buf[:]
+        self.offset = 0
+
+    def __len__(self):
+        return len(self.buf) - self.offset
+
+    def get_left_data(self):
+        return bytes(self.buf[self.offset:])
+
+    def drop(self, size):
+        if self.LOG:
+            self.LOG.warn(HexDump(
+                bytes(self.buf[self.offset:self.offset + size]), title='give up dirty data:'))
+        self.offset += size
+
+    def compact(self):
+        if self.offset >= len(self.buf):
+            del self.buf[:]
+            self.offset = 0
+        elif self.offset >= self.compact_size or self.offset * 2 >= len(self.buf):
+            del self.buf[:self.offset]
+            self.offset = 0
+
+    def feed(self, data):
+        self.buf += data
+        return self.frames()
+
+    def frames(self):
+        frames = []
+        buf = self.buf
+        while True:
+            start = buf.find(self.magic, self.offset)
+            if start < 0:
+                # keep the tail, it may be the beginning of the next magic
+                keep = max(self.offset, len(buf) - len(self.magic) + 1)
+                if keep > self.offset:
+                    self.drop(keep - self.offset)
+                break
+            if start > self.offset:
+                self.drop(start - self.offset)
+
+            if len(buf) - start < self.head_length:
+                break
+            length = struct.unpack_from('>I', buf, start + 49)[0]
+            end = start + self.head_length + length
+            if end <= len(buf):
+                with memoryview(buf) as view:
+                    frames.append(view[start:end].tobytes())
+                self.offset = end
+            elif length < self.max_length:
+                break
+            else:
+                self.drop(len(self.magic))
+
+        self.compact()
+        return frames
+
+
 class SDK(communication_base):
     state_lock = threading.Lock()
 
-    def __init__(self, addr, logger, time_delay=0, self_addr=None):
+    # inline: recv_into a buff_size buffer and frame in the recv loop
+    def __init__(self, addr, logger, time_delay=0, self_addr=None, buff_size=my_socket.BUFF_SIZE, inline=False):
         self.queue_in = Queue.Queue()
         self.queue_out = Queue.Queue()
         super(SDK, self).__init__(self.queue_in, self.queue_out,
@@ -41,10 +114,15 @@ class SDK(communication_base):
         self.addr = addr
         self.name = 'Device controler'
         self.connection = my_socket.MyClient(
-            addr, logger, self_addr=self_addr, debug=False)
+            addr, logger, self_addr=self_addr, debug=False, buff_size=buff_size, recv_into=inline)
+        if inline:
+            self.framer = HDXMFramer(self.LOG)
         self.state = 'close'
         self.time_delay = time_delay
         self.sim_obj = None
+        # data -> length + crc + data, replies repeat between state changes
+        self.frame_tails = {}
+        self.frame_cache_size = 64
 
         # status data:
         # 4bytes
@@ -55,11 +133,7 @@ class SDK(communication_base):
         self.pkg_number = b'\x00\x00\x00\x01'
 
     def msg_build(self, data, ack=b'\x01'):
-        self.LOG.yinfo("send msg: " + self.convert_to_dictstr(data))
-        if isinstance(data, type(b'')):
-            pass
-        else:
-            data = data.encode('utf-8')
+        self.LOG.yinfo("send msg: %s", LazyStr(self.convert_to_dictstr, data))
         if ack == b'\x00':
             src_id = self.device_id
             dst_id = b'\x30' * 20
@@ -73,42 +147,24 @@ class SDK(communication_base):
         else:
             src_id = src_id.encode('utf-8')
         msg_head = self.version + src_id + dst_id + ack + self.pkg_number
-        msg_length = self.get_msg_length(data)
-        msg_crc16 = crc16(data)
-        msg = msg_head + msg_length + b'\x00\x00' + msg_crc16 + data
-        return msg
-
-    def protocol_data_washer(self, data):
-        data_list = []
-        left_data = b''
-
-        while data[0:1] != b'\x48' and len(data) >= self.min_length:
-            self.LOG.warn('give up dirty data: %02x' % ord(data[0]))
-            data = data[1:]
+        return msg_head + self.get_frame_tail(data)
 
-        if len(data) < self.min_length:
-            left_data = data
-        else:
-            if data[0:4] == b'\x48\x44\x58\x4d':
-                length = struct.unpack('>I', data[49:53])[0]
-                if length <= len(data[57:]):
-                    data_list.append(data[0:57 + length])
-                    data = data[57 + length:]
-                    if data:
-                        data_list_tmp, left_data_tmp = self.protocol_data_washer(
-                            data)
-                        data_list += data_list_tmp
-                        left_data += left_data_tmp
-                elif length >= 1 and length < 1000:
-                    left_data = data
-                else:
-                    for s in data[:4]:
-                        self.LOG.warn('give up dirty data: %02x' % ord(s))
-                    left_data = data[4:]
-            else:
-                pass
+    def get_frame_tail(self, data):
+        tail = self.frame_tails.get(data)
+        if tail is None:
+            key = data
+            if not isinstance(data, type(b'')):
+                data = data.encode('utf-8')
+            tail = self.get_msg_length(data) + b'\x00\x00' + crc16(data) + data
+            if len(self.frame_tails) >= self.frame_cache_size:
+                self.frame_tails.clear()
+            self.frame_tails[key] = tail
+        return tail
 
-        return data_list, left_data
+    def protocol_data_washer(self, data):
+        framer = HDXMFramer(self.LOG)
+        data_list = framer.feed(data)
+        return data_list, framer.get_left_data()
 
     def add_pkg_number(self):
         pkg_number = struct.unpack('>I', self.pkg_number)[0]
@@ -138,7 +194,7 @@ class SDK(communication_base):
                 crc16 = struct.unpack('>H', msg[55:57])
                 data = json.loads(msg[57:57 + data_length].decode('utf-8'))
                 self.LOG.info("recv msg: " + self.convert_to_dictstr(data))
-                time.sleep(self.time_delay / 1000.0)
+                clock.sleep(self.time_delay / 1000.0)
                 rsp_msg = self.sim_obj.protocol_handler(data, ack)
                 if rsp_msg:
                     final_rsp_msg = self.msg_build(rsp_msg)
@@ -177,13 +233,26 @@ class SDK(communication_base):
             self.LOG.error('Close connection failed!')
 
     def send_data(self, data):
-        self.LOG.debug(protocol_data_printB(
+        self.LOG.debug(HexDump(
             data, " send data:"))
         return self.connection.send_once(data)
 
+    def send_batch(self, datas):
+        for data in datas:
+            self.LOG.debug(HexDump(
+                data, " send data:"))
+        return self.connection.send_batch(datas)
+
     def recv_data(self):
         datas = self.connection.recv_once()
         if datas:
-            self.LOG.debug(protocol_data_printB(
+            self.LOG.debug(HexDump(
+                datas, " recv data:"))
+        return datas
+
+    def recv_view(self):
+        datas = self.connection.recv_into_once()
+        if datas:
+            self.LOG.debug(HexDump(
                 datas, " recv data:"))
         return datas
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""msg template compile
+by Kobe Gong. 2018-2-8
+use:
+    the config dicts are compiled once into closures, slots:
+        "##self._attr##" -> getattr(sim_obj, '_attr')
+        "TIMENOW"        -> now, '%Y-%m-%d %H:%M:%S'
+        "randint1"       -> "0" or "1"
+"""
+
+import datetime
+import random
+import re
+import threading
+
+import APIs.common_APIs as common_APIs
+import basic.clock as clock
+
+slot_re = re.compile(r'^##self\.(\w+)##$')
+
+
+class MsgTemplate():
+    def __init__(self, src):
+        self.attrs = set()
+        # dynamic: output changes without any attr change(time, random)
+        self.dynamic = False
+        self.build = self.compile(src)
+
+    def compile(self, node):
+        if isinstance(node, dict):
+            items = [(key, self.compile(value)) for key, value in node.items()]
+            return lambda obj: dict([(key, build(obj)) for key, build in items])
+
+        elif isinstance(node, (list, tuple)):
+            builds = [self.compile(value) for value in node]
+            return lambda obj: [build(obj) for build in builds]
+
+        elif isinstance(node, (type(''), type(u''))):
+            match = slot_re.match(node)
+            if match:
+                attr = match.group(1)
+                self.attrs.add(attr)
+                return lambda obj: getattr(obj, attr)
+            elif node == 'TIMENOW':
+                self.dynamic = True
+                return lambda obj: clock.now().strftime('%Y-%m-%d %H:%M:%S')
+            elif node == 'randint1':
+                self.dynamic = True
+                return lambda obj: str(random.randint(0, 1))
+
+        return lambda obj: node
+
+    def render(self, obj):
+        return self.build(obj)
+
+
+template_lock = threading.Lock()
+templates = {}
+set_items_cache = {}
+
+
+# hot path: a cache hit is one dict get, the lock is only for compiling
+def get_template(config, command, section=None):
+    key = (config.__name__, command, section)
+    template = templates.get(key)
+    if template is None:
+        template = compile_template(key, config, command, section)
+    return template
+
+
+@common_APIs.need_add_lock(template_lock)
+def compile_template(key, config, command, section):
+    if key not in templates:
+        src = getattr(config, command)
+        if section:
+            src = src[section]
+        templates[key] = MsgTemplate(src)
+    return templates[key]
+
+
+def get_set_items(config, command):
+    key = (config.__name__, command)
+    set_items = set_items_cache.get(key)
+    if set_items is None:
+        set_items = compile_set_items(key, config, command)
+    return set_items
+
+
+@common_APIs.need_add_lock(template_lock)
+def compile_set_items(key, config, command):
+    if key not in set_items_cache:
+        item_dict = getattr(config, command)['set_item']
+        set_items_cache[key] = [(item, msg_param.split('.'))
+                                for item, msg_param in item_dict.items()]
+    return set_items_cache[key]
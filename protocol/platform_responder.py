@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""platform responder for MyServer
+by Kobe Gong. 2018-2-11
+use:
+    responder = HDXMResponder(LOG)
+    responder.register('COM_UPLOAD_EVENT', handler)
+    server = MyServer(addr, LOG, responder=responder)
+    handler(client, msg, frame) return the rsp frame or None
+"""
+
+import json
+import struct
+from abc import abstractmethod
+from collections import defaultdict
+
+from APIs.common_APIs import crc16
+from protocol.light_protocol import HDXMFramer
+
+
+class PlatformResponder(object):
+    # subclasses split the client datas into frames(get_frames, kept per
+    # client till drop) and decode the frames
+    def __init__(self, logger):
+        self.LOG = logger
+        self.handlers = {}
+        self.default_handler = None
+        self.msgst = defaultdict(lambda: {'req': 0, 'rsp': 0})
+
+    def register(self, command, handler):
+        self.handlers[command] = handler
+
+    def set_default_handler(self, handler):
+        self.default_handler = handler
+
+    def drop(self, client):
+        pass
+
+    @abstractmethod
+    def get_frames(self, client, data):
+        pass
+
+    @abstractmethod
+    def decode(self, frame):
+        pass
+
+    def feed(self, client, data):
+        rsps = []
+        for frame in self.get_frames(client, data):
+            command, msg = self.decode(frame)
+            if command is None:
+                continue
+            self.msgst[command]['req'] += 1
+            handler = self.handlers.get(command, self.default_handler)
+            if not handler:
+                self.LOG.debug('No handler for: %s' % (command))
+                continue
+            rsp = handler(client, msg, frame)
+            if rsp:
+                self.msgst[command]['rsp'] += 1
+                rsps.append(rsp)
+        return rsps
+
+
+class HDXMResponder(PlatformResponder):
+    platform_id = b'\x30' * 20
+
+    def __init__(self, logger):
+        super(HDXMResponder, self).__init__(logger)
+        self.framers = {}
+        self.ack_heads = {}
+        self.ack_tails = {}
+        self.set_default_handler(self.ack)
+
+    def drop(self, client):
+        if client in self.framers:
+            del self.framers[client]
+
+    def get_frames(self, client, data):
+        if client not in self.framers:
+            self.framers[client] = HDXMFramer(self.LOG)
+        return self.framers[client].feed(data)
+
+    def decode(self, frame):
+        try:
+            msg = json.loads(frame[57:].decode('utf-8'))
+            return msg['Command'], msg
+        except Exception as e:
+            self.LOG.error('Bad frame: %s' % (e))
+            return None, None
+
+    def get_ack_tail(self, command, result=0):
+        key = (command, result)
+        if key not in self.ack_tails:
+            data = json.dumps(
+                {"Result": result, "Command": command}).encode('utf-8')
+            self.ack_tails[key] = struct.pack(
+                '>I', len(data)) + b'\x00\x00' + crc16(data) + data
+        return self.ack_tails[key]
+
+    # ack frame: HDXM + src(platform) + dst(device) + ack flag, pkg number, tail
+    def build_ack(self, device_id, pkg_number, command, result=0):
+        if device_id not in self.ack_heads:
+            self.ack_heads[device_id] = HDXMFramer.magic + \
+                self.platform_id + device_id + b'\x01'
+        return self.ack_heads[device_id] + pkg_number + self.get_ack_tail(command, result)
+
+    def ack(self, client, msg, frame):
+        return self.build_ack(frame[4:24], frame[45:49], msg['Command'])
+
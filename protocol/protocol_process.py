@@ -19,6 +19,7 @@ from abc import ABCMeta, abstractmethod
 from collections import defaultdict
 
 import APIs.common_APIs as common_APIs
+import basic.clock as clock
 from APIs.common_APIs import protocol_data_printB
 
 try:
@@ -33,8 +34,6 @@ if sys.getdefaultencoding() != 'utf-8':
 
 
 class communication_base(object):
-    send_lock = threading.Lock()
-
     def __init__(self, queue_in, queue_out, logger, left_data=b'', min_length=10):
         self.queue_in = queue_in
         self.queue_out = queue_out
@@ -46,6 +45,12 @@ class communication_base(object):
         self.heartbeat_interval = 3
         self.heartbeat_data = None
         self.need_stop = False
+        self.send_notify = None
+        self.send_lock = threading.Lock()
+        self.queue_timeout = 1
+        # inline framer: recv loop feeds it directly, queue_in and
+        # schedule_loop are skipped
+        self.framer = None
 
     @abstractmethod
     def protocol_handler(self, msg):
@@ -55,9 +60,15 @@ class communication_base(object):
     def protocol_data_washer(self, data):
         pass
 
-    def run_forever(self):
+    def run_forever(self, engine='thread'):
+        if engine == 'asyncio':
+            from protocol.async_engine import get_engine
+            get_engine(self.LOG).add_device(self)
+            return
+
         thread_list = []
-        thread_list.append([self.schedule_loop])
+        if self.framer is None:
+            thread_list.append([self.schedule_loop])
         thread_list.append([self.send_data_loop])
         thread_list.append([self.recv_data_loop])
         thread_list.append([self.heartbeat_loop])
@@ -95,20 +106,30 @@ class communication_base(object):
     def recv_data(self, data):
         pass
 
-    @common_APIs.need_add_lock(send_lock)
+    @common_APIs.need_add_self_lock('send_lock')
     def add_send_data(self, data):
         self.queue_out.put(data)
+        if self.send_notify:
+            self.send_notify()
+
+    # one call for all the datas, socket sdks send them with one sendmsg
+    def send_batch(self, datas):
+        for data in datas:
+            self.send_data(data)
 
-    @common_APIs.need_add_lock(send_lock)
+    @common_APIs.need_add_self_lock('send_lock')
+    def send_datas(self, datas):
+        self.send_batch(datas)
+
+    @common_APIs.need_add_self_lock('send_lock')
     def send_data_once(self, data=None):
         if data:
             self.queue_out.put(data)
-        if self.queue_out.empty():
-            pass
-        else:
-            while not self.queue_out.empty():
-                data = self.queue_out.get()
-                self.send_data(data)
+        datas = []
+        while not self.queue_out.empty():
+            datas.append(self.queue_out.get())
+        if datas:
+            self.send_batch(datas)
 
     def recv_data_once(self):
         #datas = ''
@@ -121,6 +142,28 @@ class communication_base(object):
             self.queue_in.put(datas)
         return datas
 
+    def recv_view(self):
+        return self.connection.recv_into_once()
+
+    def recv_frames_once(self):
+        datas = self.recv_view()
+        if datas:
+            self.frames_handle(self.framer.feed(datas))
+        return datas
+
+    def get_datas(self, queue):
+        try:
+            datas = [queue.get(timeout=self.queue_timeout)]
+        except Queue.Empty:
+            return []
+
+        while True:
+            try:
+                datas.append(queue.get_nowait())
+            except Queue.Empty:
+                break
+        return datas
+
     def send_data_loop(self):
         while self.need_stop == False:
             if self.get_connection_state():
@@ -129,9 +172,11 @@ class communication_base(object):
                 if self.connection_setup():
                     pass
                 else:
-                    time.sleep(1)
+                    clock.sleep(1)
                     continue
-            self.send_data_once()
+            datas = self.get_datas(self.queue_out)
+            if datas:
+                self.send_datas(datas)
 
     def recv_data_loop(self):
         while self.need_stop == False:
@@ -139,11 +184,15 @@ class communication_base(object):
                 pass
             else:
                 if self.connection_setup():
-                    pass
+                    if self.framer is not None:
+                        self.framer.reset()
                 else:
-                    time.sleep(1)
+                    clock.sleep(1)
                     continue
-            self.recv_data_once()
+            if self.framer is not None:
+                self.recv_frames_once()
+            else:
+                self.recv_data_once()
 
     def heartbeat_loop(self, debug=True):
         while self.need_stop == False:
@@ -162,29 +211,36 @@ class communication_base(object):
                 self.send_data_once(data=data)
             else:
                 self.LOG.debug('offline?')
-            time.sleep(self.heartbeat_interval)
+            clock.sleep(self.heartbeat_interval)
 
     def schedule_loop(self):
         while self.need_stop == False:
-            if self.queue_in.empty():
-                continue
+            datas = self.get_datas(self.queue_in)
+            if datas:
+                self.data_handle(datas[0][:0].join(datas))
+
+    def data_frames(self, data):
+        ori_data = self.left_data + data
+        if len(ori_data) < self.min_length:
+            self.left_data = ori_data
+            return []
+
+        data_list, self.left_data = self.protocol_data_washer(ori_data)
+        return data_list
+
+    def data_handle(self, data):
+        self.frames_handle(self.data_frames(data))
+
+    def frames_handle(self, data_list):
+        for request_msg in data_list:
+            response_msg = self.protocol_handler(request_msg)
+            if response_msg == 'No_need_send':
+                pass
+            elif response_msg:
+                self.queue_out.put(response_msg)
             else:
-                ori_data = self.left_data + self.queue_in.get()
-                while len(ori_data) < self.min_length:
-                    ori_data += self.queue_in.get()
-                data_list, self.left_data = self.protocol_data_washer(ori_data)
-                if data_list:
-                    for request_msg in data_list:
-                        response_msg = self.protocol_handler(request_msg)
-                        if response_msg == 'No_need_send':
-                            pass
-                        elif response_msg:
-                            self.queue_out.put(response_msg)
-                        else:
-                            self.LOG.error(protocol_data_printB(
-                                request_msg, title='%s: got invalid data:' % (self.name)))
-                else:
-                    continue
+                self.LOG.error(protocol_data_printB(
+                    request_msg, title='%s: got invalid data:' % (self.name)))
 
     def stop(self):
         self.need_stop = True
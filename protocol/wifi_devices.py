@@ -23,8 +23,10 @@ from collections import defaultdict
 from importlib import import_module
 
 import APIs.common_APIs as common_APIs
+import basic.clock as clock
 from APIs.common_APIs import bit_clear, bit_get, bit_set, protocol_data_printB
 from basic.log_tool import MyLogger
+from basic.state_store import DirtyTracker
 from basic.task import Task
 from protocol.light_protocol import SDK
 from protocol.wifi_protocol import Wifi
@@ -38,7 +40,7 @@ coding = sys.getfilesystemencoding()
 alarm_lock = threading.Lock()
 
 
-class BaseSim():
+class BaseSim(DirtyTracker):
     __metaclass__ = ABCMeta
     status_lock = threading.Lock()
 
@@ -55,7 +57,7 @@ class BaseSim():
     @common_APIs.need_add_lock(status_lock)
     def set_item(self, item, value):
         if item in self.__dict__:
-            self.__dict__[item] = value
+            setattr(self, item, value)
         else:
             self.LOG.error("Unknow item: %s" % (item))
 
@@ -86,12 +88,12 @@ class BaseSim():
         self.LOG.warn('Thread %s stoped!' % (__name__))
 
     def run_forever(self):
+        self.task_obj.task_proc()
         thread_list = []
         thread_list.append([self.sdk_obj.schedule_loop])
         thread_list.append([self.sdk_obj.send_data_loop])
         thread_list.append([self.sdk_obj.recv_data_loop])
         thread_list.append([self.sdk_obj.heartbeat_loop, False])
-        thread_list.append([self.task_obj.task_proc])
         thread_list.append([self.alarm_proc])
         thread_ids = []
         for th in thread_list:
@@ -112,20 +114,13 @@ class BaseSim():
         pass
 
     def status_report_monitor(self):
-        need_send_report = False
-        if not hasattr(self, 'old_status'):
-            self.old_status = defaultdict(lambda: {})
-            for item in self.__dict__:
-                if item.startswith('_'):
-                    self.LOG.yinfo("need check item: %s" % (item))
-                    self.old_status[item] = copy.deepcopy(self.__dict__[item])
-
-        for item in self.old_status:
-            if self.old_status[item] != self.__dict__[item]:
-                need_send_report = True
-                self.old_status[item] = copy.deepcopy(self.__dict__[item])
-
-        if need_send_report:
+        if not self.tracking():
+            items = [item for item in self.__dict__ if item.startswith('_')]
+            for item in items:
+                self.LOG.yinfo("need check item: %s" % (item))
+            self.track_items(items)
+
+        if self.take_dirty():
             self.send_msg(self.get_event_report())
 
     def alarm_proc(self):
@@ -141,7 +136,7 @@ class BaseSim():
                     pass
 
             alarm_lock.release()
-            time.sleep(3)
+            clock.sleep(3)
 
     def alarm_report(self, error_code, error_status, error_level=1, error_msg="test alarm"):
         report_msg = {
@@ -537,6 +532,7 @@ class Waterfilter(BaseSim):
         if int(id) in self._filter_time_total:
             self._filter_time_remaining[int(
                 id)] = self._filter_time_total[int(id)]
+            self.mark_dirty('_filter_time_remaining')
             return True
         else:
             self.LOG.error('Unknow ID: %s' % (id))
@@ -21,8 +21,9 @@ from abc import ABCMeta, abstractmethod
 from collections import defaultdict
 
 import APIs.common_APIs as common_APIs
+import basic.clock as clock
 import connections.my_socket as my_socket
-from APIs.common_APIs import crc, protocol_data_printB
+from APIs.common_APIs import HexDump, LazyStr, crc, protocol_data_printB
 from protocol.protocol_process import communication_base
 
 
@@ -43,6 +44,10 @@ class Wifi(communication_base):
         self.sim_obj = None
         self.heartbeat_interval = 3
         self.heartbeat_data = '0'
+        # data -> frame, request -> device info reply, both bounded
+        self.frame_cache = {}
+        self.info_cache = {}
+        self.cache_size = 64
 
         # state data:
         # 2:short version
@@ -72,11 +77,16 @@ class Wifi(communication_base):
 
     def msg_build(self, data):
         # self.LOG.debug(str(data))
-        self.LOG.yinfo("send msg: " + self.convert_to_dictstr(data))
-        msg_head = self.get_msg_head(data)
-        msg_code = '\x01'
-        msg_length = self.get_msg_length(msg_code + data + '\x00')
-        msg = msg_head + msg_length + msg_code + data + '\x00'
+        self.LOG.yinfo("send msg: %s", LazyStr(self.convert_to_dictstr, data))
+        msg = self.frame_cache.get(data)
+        if msg is None:
+            msg_head = self.get_msg_head(data)
+            msg_code = '\x01'
+            msg_length = self.get_msg_length(msg_code + data + '\x00')
+            msg = msg_head + msg_length + msg_code + data + '\x00'
+            if len(self.frame_cache) >= self.cache_size:
+                self.frame_cache.clear()
+            self.frame_cache[data] = msg
         return msg
 
     def protocol_data_washer(self, data):
@@ -128,53 +138,62 @@ class Wifi(communication_base):
         #self.LOG.debug(protocol_data_printB(resp_msg, title="length is:"))
         return resp_msg
 
-    def protocol_handler(self, msg):
+    def info_handler(self, msg):
         coding = sys.getfilesystemencoding()
-        if msg[2] == b'\x02':
-            if msg[3] == b'\x20':
-                if msg[4:6] == b'\x00\x05':
-                    self.LOG.warn("获取设备信息".decode('utf-8').encode(coding))
-                    rsp_msg = ''
-                    rsp_msg += self.version
-                    rsp_msg += self.mac
-                    rsp_msg += self.manufacture
-                    rsp_msg += self.deviceCategory
-                    rsp_msg += self.subCategory
-                    rsp_msg += self.deviceModel
-                    rsp_msg += self.firmwareVersion
-                    rsp_msg += self.token
-                    rsp_msg += self.wait_added
-                    msg_head = self.get_msg_head(msg)
-                    msg_code = self.get_msg_code(msg)
-                    msg_length = self.get_msg_length(msg_code + rsp_msg)
-                    return msg_head + msg_length + msg_code + rsp_msg
-
-                elif msg[4:6] == b'\x00\x04':
-                    self.LOG.warn("查询设备".decode('utf-8').encode(coding))
-                    msg_head = self.get_msg_head(msg)
-                    msg_code = self.get_msg_code(msg)
-                    msg_length = self.get_msg_length(msg_code)
-                    return msg_head + msg_length + msg_code
-
-                elif msg[4:6] == b'\x00\x06':
-                    self.LOG.warn("删除设备".decode('utf-8').encode(coding))
-                    msg_head = self.get_msg_head(msg)
-                    msg_code = self.get_msg_code(msg)
-                    msg_length = self.get_msg_length(msg_code)
-                    return msg_head + msg_length + msg_code
+        if msg[3] == b'\x20':
+            if msg[4:6] == b'\x00\x05':
+                self.LOG.warn("获取设备信息".decode('utf-8').encode(coding))
+                rsp_msg = ''
+                rsp_msg += self.version
+                rsp_msg += self.mac
+                rsp_msg += self.manufacture
+                rsp_msg += self.deviceCategory
+                rsp_msg += self.subCategory
+                rsp_msg += self.deviceModel
+                rsp_msg += self.firmwareVersion
+                rsp_msg += self.token
+                rsp_msg += self.wait_added
+                msg_head = self.get_msg_head(msg)
+                msg_code = self.get_msg_code(msg)
+                msg_length = self.get_msg_length(msg_code + rsp_msg)
+                return msg_head + msg_length + msg_code + rsp_msg
 
-                else:
-                    self.LOG.error('Unknow msg: %s' % (msg[4:6]))
-                    return "No_need_send"
+            elif msg[4:6] == b'\x00\x04':
+                self.LOG.warn("查询设备".decode('utf-8').encode(coding))
+                msg_head = self.get_msg_head(msg)
+                msg_code = self.get_msg_code(msg)
+                msg_length = self.get_msg_length(msg_code)
+                return msg_head + msg_length + msg_code
+
+            elif msg[4:6] == b'\x00\x06':
+                self.LOG.warn("删除设备".decode('utf-8').encode(coding))
+                msg_head = self.get_msg_head(msg)
+                msg_code = self.get_msg_code(msg)
+                msg_length = self.get_msg_length(msg_code)
+                return msg_head + msg_length + msg_code
 
             else:
-                self.LOG.error('Unknow msg: %s' % (msg[3:6]))
+                self.LOG.error('Unknow msg: %s' % (msg[4:6]))
                 return "No_need_send"
 
+        else:
+            self.LOG.error('Unknow msg: %s' % (msg[3:6]))
+            return "No_need_send"
+
+    def protocol_handler(self, msg):
+        coding = sys.getfilesystemencoding()
+        if msg[2] == b'\x02':
+            # the device info fields do not change, same request same reply
+            if msg not in self.info_cache:
+                if len(self.info_cache) >= self.cache_size:
+                    self.info_cache.clear()
+                self.info_cache[msg] = self.info_handler(msg)
+            return self.info_cache[msg]
+
         elif msg[2] == b'\x03':
             dict_msg = json.loads(msg[3:-1])
             self.LOG.info("recv msg: " + self.convert_to_dictstr(dict_msg))
-            time.sleep(self.time_delay / 1000.0)
+            clock.sleep(self.time_delay / 1000.0)
             rsp_msg = self.sim_obj.protocol_handler(dict_msg)
             if rsp_msg:
                 final_rsp_msg = self.msg_build(rsp_msg)
@@ -209,14 +228,20 @@ class Wifi(communication_base):
             self.LOG.error('Close connection failed!')
 
     def send_data(self, data):
-        self.LOG.debug(protocol_data_printB(
+        self.LOG.debug(HexDump(
             data, " send data:"))
         return self.connection.send_once(data)
 
+    def send_batch(self, datas):
+        for data in datas:
+            self.LOG.debug(HexDump(
+                data, " send data:"))
+        return self.connection.send_batch(datas)
+
     def recv_data(self):
         datas = self.connection.recv_once()
         if datas:
-            self.LOG.debug(protocol_data_printB(
+            self.LOG.debug(HexDump(
                 datas, " recv data:"))
         return datas
 
@@ -25,6 +25,7 @@ from importlib import import_module
 import APIs.common_APIs as common_APIs
 from APIs.common_APIs import bit_clear, bit_get, bit_set, protocol_data_printB
 from basic.log_tool import MyLogger
+from basic.state_store import DirtyTracker
 from basic.task import Task
 from protocol.light_protocol import SDK
 
@@ -35,7 +36,7 @@ if sys.getdefaultencoding() != 'utf-8':
 coding = sys.getfilesystemencoding()
 
 
-class BaseSim():
+class BaseSim(DirtyTracker):
     __metaclass__ = ABCMeta
     status_lock = threading.Lock()
 
@@ -51,7 +52,7 @@ class BaseSim():
     @common_APIs.need_add_lock(status_lock)
     def set_item(self, item, value):
         if item in self.__dict__:
-            self.__dict__[item] = value
+            setattr(self, item, value)
         else:
             self.LOG.error("Unknow item: %s" % (item))
 
@@ -81,9 +82,17 @@ class BaseSim():
             self.task_obj.stop()
         self.LOG.warn('Thread %s stoped!' % (__name__))
 
+    # driven by the gateway: tasks in the shared scheduler, changes through
+    # the gateway change queue, no thread of its own
+    def attach(self, sdk_obj, change_queue):
+        self.sdk_obj = sdk_obj
+        self.track_status()
+        self.set_change_queue(change_queue)
+        self.task_obj.task_proc()
+
     def run_forever(self):
+        self.task_obj.task_proc()
         thread_list = []
-        thread_list.append([self.task_obj.task_proc])
         thread_list.append([self.status_report_monitor])
         thread_ids = []
         for th in thread_list:
@@ -94,34 +103,32 @@ class BaseSim():
             th.start()
 
     def create_tasks(self):
-        self.task_obj.add_task(
-            'status maintain', self.status_maintain, 10000000, 1)
+        # no tick task for the devices without status maintain
+        if self.status_maintain:
+            self.task_obj.add_task(
+                'status maintain', self.status_maintain, 10000000, 1)
 
         # self.task_obj.add_task('monitor event report',
         #                       self.status_report_monitor, 10000000, 1)
 
-    def status_maintain(self):
-        pass
+    status_maintain = None
+
+    def track_status(self):
+        if not self.tracking():
+            items = [item for item in self.__dict__ if item.startswith('_')]
+            for item in items:
+                self.LOG.yinfo("need check item: %s" % (item))
+            self.track_items(items)
 
     def status_report_monitor(self):
+        self.track_status()
         while self.need_stop == False:
-            need_send_report = []
-            if not hasattr(self, 'old_status'):
-                self.old_status = defaultdict(lambda: {})
-                for item in self.__dict__:
-                    if item.startswith('_'):
-                        self.LOG.yinfo("need check item: %s" % (item))
-                        self.old_status[item] = copy.deepcopy(
-                            self.__dict__[item])
-
-            for item in self.old_status:
-                if self.old_status[item] != self.__dict__[item]:
-                    need_send_report.append(item)
-                    self.old_status[item] = copy.deepcopy(self.__dict__[item])
-
-            for item in need_send_report:
-                self.LOG.warn('Device report: %s' % (item))
-                self.event_report_proc(item)
+            self.report_dirty(wait=True, timeout=1)
+
+    def report_dirty(self, wait=False, timeout=None):
+        for item in sorted(self.take_dirty(wait=wait, timeout=timeout)):
+            self.LOG.warn('Device report: %s' % (item))
+            self.event_report_proc(item)
 
     def get_default_response(self, datas):
         def_rsp = {
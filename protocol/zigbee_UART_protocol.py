@@ -18,10 +18,11 @@ import time
 from collections import defaultdict
 
 import APIs.common_APIs as common_APIs
-from APIs.common_APIs import (bit_clear, bit_get, bit_set, crc16,
+import basic.clock as clock
+from APIs.common_APIs import (HexDump, bit_clear, bit_get, bit_set, crc16,
                               protocol_data_printB)
 from basic.task import Task
-from connections.my_serial import MySerial
+from connections.my_serial import get_serial
 from protocol.protocol_process import communication_base
 
 try:
@@ -32,6 +33,49 @@ except:
 coding = sys.getfilesystemencoding()
 
 
+# 子设备表: short_id -> device, 以及每个设备的 endpoint 集合
+# 帧里的地址是 short_id(2 bytes) + endpoint(1 byte)
+class DeviceTable():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.devices = {}
+        self.endpoints = {}
+
+    def add(self, short_id, device, endpoints):
+        with self.lock:
+            self.devices[short_id] = device
+            self.endpoints[short_id] = set(endpoints)
+
+    def get(self, addr):
+        short_id = addr[0:2]
+        if addr[2:3] in self.endpoints.get(short_id, ()):
+            return self.devices[short_id]
+        return None
+
+    def __contains__(self, addr):
+        return self.get(addr) is not None
+
+    def __getitem__(self, addr):
+        device = self.get(addr)
+        if device is None:
+            raise KeyError(addr)
+        return device
+
+    def __len__(self):
+        return len(self.devices)
+
+    def values(self):
+        return list(self.devices.values())
+
+    # 0x0000 is the coordinator, 0xfff8 - 0xffff are reserved
+    def new_short_id(self):
+        with self.lock:
+            while True:
+                short_id = struct.pack('>H', random.randint(0x0001, 0xfff7))
+                if short_id not in self.devices:
+                    return short_id
+
+
 class ZIGBEE(communication_base):
     status_lock = threading.Lock()
     factory_lock = threading.Lock()
@@ -41,8 +85,10 @@ class ZIGBEE(communication_base):
         self.LOG = logger
         super(ZIGBEE, self).__init__(queue_in=Queue.Queue(),
                                      queue_out=Queue.Queue(), logger=logger, left_data='', min_length=18)
-        self.connection = MySerial(port, 115200, logger)
-        self.devices = defaultdict(str)
+        self.connection = get_serial(port, 115200, logger)
+        self.devices = DeviceTable()
+        # dirty sub-devices, reported from report_loop
+        self.change_queue = Queue.Queue()
         self.factory = ''
         self.state = 'close'
         self.time_delay = time_delay
@@ -55,6 +101,9 @@ class ZIGBEE(communication_base):
         self.dst_addr = b''
         self.src_addr = b'\x00\x00\xf1'
         self.working = False
+        # same datas(seq wraps at 256) same frame, bounded
+        self.frame_cache = {}
+        self.frame_cache_size = 1024
 
     @common_APIs.need_add_lock(factory_lock)
     def set_work_status(self, status):
@@ -75,6 +124,12 @@ class ZIGBEE(communication_base):
     def msg_build(self, datas):
         if len(datas) < 6:
             return 'No_need_send'
+        key = (datas['control'], datas['seq'], self.dst_addr, datas['addr'],
+               datas['cmd'], datas['reserve'], datas['data'])
+        rsp_msg = self.frame_cache.get(key)
+        if rsp_msg is not None:
+            return rsp_msg
+
         tmp_msg = datas['control'] + datas['seq'] + self.dst_addr + \
             datas['addr'] + datas['cmd'] + datas['reserve'] + datas['data']
 
@@ -83,6 +138,9 @@ class ZIGBEE(communication_base):
         rsp_msg += tmp_msg
         rsp_msg += crc16(rsp_msg, reverse=True)
         #self.LOG.yinfo("send msg: " + self.convert_to_dictstr(datas))
+        if len(self.frame_cache) >= self.frame_cache_size:
+            self.frame_cache.clear()
+        self.frame_cache[key] = rsp_msg
         return rsp_msg
 
     def protocol_data_washer(self, data):
@@ -115,12 +173,13 @@ class ZIGBEE(communication_base):
         return msg_list, left_data
 
     def run_forever(self):
+        self.task_obj.task_proc()
         thread_list = []
         thread_list.append([self.schedule_loop])
         thread_list.append([self.send_data_loop])
         thread_list.append([self.recv_data_loop])
         thread_list.append([self.heartbeat_loop])
-        thread_list.append([self.task_obj.task_proc])
+        thread_list.append([self.report_loop])
         thread_ids = []
         for th in thread_list:
             thread_ids.append(threading.Thread(target=th[0], args=th[1:]))
@@ -129,6 +188,14 @@ class ZIGBEE(communication_base):
             th.setDaemon(True)
             th.start()
 
+    def report_loop(self):
+        while self.need_stop == False:
+            try:
+                device = self.change_queue.get(timeout=self.queue_timeout)
+            except Queue.Empty:
+                continue
+            device.report_dirty()
+
     def protocol_handler(self, msg):
         if msg[0:2] == b'\xaa\x55':
             length = struct.unpack('B', msg[2:2 + 1])[0]
@@ -151,15 +218,13 @@ class ZIGBEE(communication_base):
                     self.task_obj.add_task(
                         'reset factory status', self.set_work_status, 1, 500, False)
                     mac = ''.join(random.sample('0123456789abcdef', 3))
-                    short_id = chr(random.randint(0, 255)) + \
-                        chr(random.randint(0, 255))
+                    short_id = self.devices.new_short_id()
                     Endpoint = b'\x00'
                     dst_addr = short_id + Endpoint
-                    self.devices[dst_addr] = self.factory(
+                    device = self.factory(
                         logger=self.LOG, mac=mac, short_id=short_id, Endpoint=Endpoint)
-                    self.devices[dst_addr].sdk_obj = self
-                    self.devices[dst_addr].run_forever()
-                    self.devices[short_id + b'\x01'] = self.devices[dst_addr]
+                    device.attach(self, self.change_queue)
+                    self.devices.add(short_id, device, [b'\x00', b'\x01'])
                     self.LOG.warn("It is time to create a new zigbee device, type: %s, mac: %s" % (
                         self.factory.__name__, mac))
                 else:
@@ -196,7 +261,7 @@ class ZIGBEE(communication_base):
                 'data': data,
             }
             #self.LOG.info("debug recv msg: " + self.convert_to_dictstr(datas))
-            time.sleep(self.time_delay / 1000.0)
+            clock.sleep(self.time_delay / 1000.0)
             rsp_datas = self.devices[dst_addr].protocol_handler(datas)
             rsp_msg = ''
             if rsp_datas:
@@ -236,14 +301,14 @@ class ZIGBEE(communication_base):
             self.LOG.error('Close connection failed!')
 
     def send_data(self, data):
-        self.LOG.yinfo(protocol_data_printB(
+        self.LOG.yinfo(HexDump(
             data, title=self.port + " send data:"))
         return self.connection.write(data)
 
     def recv_data(self):
         datas = self.connection.readall()
         if datas:
-            self.LOG.info(protocol_data_printB(
+            self.LOG.info(HexDump(
                 datas, title=self.port + " recv data:"))
         return datas
 
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""uart bench, serial sims on virtual ports, flooded from the other end
+by Kobe Gong. 2018-2-16
+use:
+    python uart_bench.py --target air -n 16 -c 10000 --engine selector
+    python uart_bench.py --target zigbee --frames zb_frames.txt
+"""
+
+import argparse
+import binascii
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+import tty
+from collections import deque
+
+import basic.clock as clock
+from APIs.common_APIs import crc
+from basic.cprint import cprint
+from basic.histogram import LatencyHistogram
+from basic.log_tool import MyLogger
+from connections.serial_engine import SerialEngine
+from protocol.air_protocol import Air
+from protocol.zb_devices import *
+from protocol.zigbee_UART_protocol import ZIGBEE
+
+
+class ArgHandle():
+    def __init__(self):
+        self.parser = self.build_option_parser("-" * 50)
+
+    def build_option_parser(self, description):
+        parser = argparse.ArgumentParser(description=description)
+        parser.add_argument(
+            '--target',
+            dest='target',
+            action='store',
+            choices=['air', 'zigbee'],
+            default='air',
+            help='Specify the serial sim to bench',
+        )
+        parser.add_argument(
+            '-n', '--ports',
+            dest='ports',
+            action='store',
+            default=1,
+            type=int,
+            help='Specify how many virtual ports',
+        )
+        parser.add_argument(
+            '-c', '--count',
+            dest='count',
+            action='store',
+            default=10000,
+            type=int,
+            help='Specify how many frames to send on each port',
+        )
+        parser.add_argument(
+            '-w', '--window',
+            dest='window',
+            action='store',
+            default=1,
+            type=int,
+            help='Specify how many frames in flight on each port',
+        )
+        parser.add_argument(
+            '-b', '--baudrate',
+            dest='baudrate',
+            action='store',
+            default=0,
+            type=int,
+            help='Pace the sending like a UART of this baudrate, 0: no pacing',
+        )
+        parser.add_argument(
+            '--frames',
+            dest='frames',
+            action='store',
+            help='Recorded frames, one hex frame per line; air: generated if not given',
+        )
+        parser.add_argument(
+            '--engine',
+            dest='engine',
+            action='store',
+            choices=['thread', 'selector'],
+            default='thread',
+            help="air only, thread: 3 threads per port; selector: one thread for all ports",
+        )
+        parser.add_argument(
+            '--device',
+            dest='device_type',
+            action='store',
+            choices={'led', 'curtain', 'switch'},
+            default='led',
+            help="zigbee only, Specify device type: 'led', 'curtain', 'switch'",
+        )
+        return parser
+
+    def get_args(self, attrname):
+        return getattr(self.args, attrname)
+
+    def check_args(self):
+        if self.get_args('target') == 'zigbee' and not self.get_args('frames'):
+            cprint.error_p("--frames should be give for zigbee!")
+            sys.exit()
+
+    def run(self):
+        self.args = self.parser.parse_args()
+        cprint.notice_p("CMD line: " + str(self.args))
+        self.check_args()
+
+
+# recorded frames: one hex frame per line, '#' for comments
+def load_frames(path):
+    frames = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#')[0].replace(' ', '').strip()
+            if line:
+                frames.append(binascii.unhexlify(line))
+    return frames
+
+
+# the driver on the other end: sends frames, window of them in flight, and
+# takes one rsp(split by washer) per frame for the latency; baudrate paces
+# the sending like a real UART, 0 means as fast as the pty goes
+class UartFlooder():
+    def __init__(self, path, logger, frames, washer, window=1, baudrate=0, timeout=2):
+        self.path = path
+        self.LOG = logger
+        self.frames = frames
+        self.washer = washer
+        self.window = window
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.hist = LatencyHistogram()
+        self.sent = 0
+        self.received = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.elapsed = 0
+
+    def run(self, count):
+        fd = os.open(self.path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        tty.setraw(fd)
+        in_flight = deque()
+        left_data = b''
+        start = next_send = clock.monotonic()
+        try:
+            while self.received < count:
+                while self.sent < count and len(in_flight) < self.window:
+                    frame = self.frames[self.sent % len(self.frames)]
+                    if self.baudrate:
+                        # 10 bits per byte: start + 8 data + stop
+                        delay = next_send - clock.monotonic()
+                        if delay > 0:
+                            clock.sleep(delay)
+                        next_send = max(next_send, clock.monotonic()) + \
+                            len(frame) * 10.0 / self.baudrate
+                    self.write(fd, frame)
+                    in_flight.append(clock.monotonic())
+                    self.sent += 1
+                    self.bytes_out += len(frame)
+
+                readable, writable, exceptional = select.select(
+                    [fd], [], [], self.timeout)
+                if not readable:
+                    self.LOG.error('%s: no rsp in %ss, %d frames lost' % (
+                        self.path, self.timeout, len(in_flight)))
+                    break
+                data = self.read(fd)
+                if not data:
+                    continue
+                self.bytes_in += len(data)
+                msgs, left_data = self.washer(left_data + data)
+                now = clock.monotonic()
+                for msg in msgs:
+                    if in_flight:
+                        self.hist.record((now - in_flight.popleft()) * 1000000)
+                    self.received += 1
+        finally:
+            self.elapsed = clock.monotonic() - start
+            os.close(fd)
+        return self.hist
+
+    def read(self, fd):
+        try:
+            return os.read(fd, 4096)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return b''
+            raise
+
+    def write(self, fd, data):
+        total = 0
+        while total < len(data):
+            try:
+                total += os.write(fd, data[total:])
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                select.select([], [fd], [], 1)
+
+
+# 空调串口请求: ff ff 长度 00 00 00 00 00 01 01 控制字 [数据] crc
+def air_frame(control, data=b''):
+    frame = b'\xFF\xFF' + struct.pack('B', len(data) + 10) + \
+        b'\x00\x00\x00\x00\x00\x01' + b'\x01' + control + data
+    return frame + crc(frame[2:])
+
+
+# mostly status queries, like the wifi module polling
+def air_frames():
+    frames = [air_frame(b'\x4d\x01')] * 6
+    frames.append(air_frame(b'\x4d\x02'))
+    frames.append(air_frame(b'\x5d\x01', b'\x00\x08'))
+    frames.append(air_frame(b'\x5d\x08', b'\x00\x01'))
+    frames.append(air_frame(b'\x4d\x22', b'\x00\x01'))
+    return frames
+
+
+def create_sims(target, ports, engine):
+    sims = []
+    for i in range(ports):
+        if target == 'air':
+            sim = Air('pty', logger=LOG)
+        else:
+            sim = ZIGBEE('pty', logger=LOG)
+            device_type = arg_handle.get_args('device_type')
+            sim.set_device(eval(device_type[0].upper() + device_type[1:]))
+        # open now, the flooder needs the other end
+        sim.connection_setup()
+        sims.append(sim)
+
+        if engine:
+            engine.add_device(sim)
+        elif target == 'air':
+            thread_list.append([sim.schedule_loop])
+            thread_list.append([sim.send_data_loop])
+            thread_list.append([sim.recv_data_loop])
+        else:
+            sim.run_forever()
+    return sims
+
+
+def sys_proc(action="default"):
+    global thread_ids
+    thread_ids = []
+    for th in thread_list:
+        thread_ids.append(threading.Thread(target=th[0], args=th[1:]))
+
+    for th in thread_ids:
+        th.setDaemon(True)
+        th.start()
+
+
+if __name__ == '__main__':
+    LOG = MyLogger(os.path.abspath(sys.argv[0]).replace('py', 'log'), clevel=logging.WARN,
+                   flevel=logging.WARN, rlevel=logging.WARN)
+    cprint = cprint(__name__)
+
+    arg_handle = ArgHandle()
+    arg_handle.run()
+
+    global thread_list
+    thread_list = []
+
+    target = arg_handle.get_args('target')
+    engine = None
+    if target == 'air' and arg_handle.get_args('engine') == 'selector':
+        engine = SerialEngine(logger=LOG)
+        thread_list.append([engine.run_forever])
+    sims = create_sims(target, arg_handle.get_args('ports'), engine)
+    sys_proc()
+
+    if arg_handle.get_args('frames'):
+        frames = load_frames(arg_handle.get_args('frames'))
+    else:
+        frames = air_frames()
+
+    # the rsps are split with the sim's own washer
+    if target == 'air':
+        parser = Air(logger=LOG)
+    else:
+        parser = ZIGBEE(None, logger=LOG)
+    flooders = []
+    for sim in sims:
+        flooders.append(UartFlooder(sim.connection.peer, LOG, frames, parser.protocol_data_washer,
+                                    window=arg_handle.get_args('window'), baudrate=arg_handle.get_args('baudrate')))
+
+    flood_threads = []
+    for flooder in flooders:
+        flood_threads.append(threading.Thread(
+            target=flooder.run, args=(arg_handle.get_args('count'),)))
+    start = time.time()
+    for th in flood_threads:
+        th.setDaemon(True)
+        th.start()
+    for th in flood_threads:
+        th.join()
+    elapsed = time.time() - start
+
+    hist = LatencyHistogram()
+    for flooder in flooders:
+        hist.merge(flooder.hist)
+    received = sum([flooder.received for flooder in flooders])
+    bytes_out = sum([flooder.bytes_out for flooder in flooders])
+    bytes_in = sum([flooder.bytes_in for flooder in flooders])
+    cprint.notice_p('%s x %d ports, engine: %s, window: %d' % (
+        target, len(sims), engine and 'selector' or 'thread', arg_handle.get_args('window')))
+    cprint.notice_p('sent %d, rsp %d in %.2fs: %.0f frames/s, out %.1fKB/s, in %.1fKB/s' % (
+        sum([flooder.sent for flooder in flooders]), received, elapsed, received / elapsed,
+        bytes_out / elapsed / 1024, bytes_in / elapsed / 1024))
+    cprint.notice_p('latency: p50 %.3fms, p90 %.3fms, p99 %.3fms, p99.9 %.3fms, max %.3fms' % tuple(
+        [hist.percentile(p) / 1000.0 for p in (50, 90, 99, 99.9)] + [(hist.max or 0) / 1000.0]))
@@ -206,7 +206,7 @@ if __name__ == '__main__':
     sim.run_forever()
 
     task_obj = Task('test-task', LOG)
-    thread_list.append([task_obj.task_proc])
+    task_obj.task_proc()
     sys_proc()
 
     if arg_handle.get_args('debug'):
@@ -32,6 +32,7 @@ from APIs.common_APIs import (my_system, my_system_full_output,
 from basic.cprint import cprint
 from basic.log_tool import MyLogger
 from basic.task import Task
+from connections.virtual_serial import is_virtual
 from protocol.zb_devices import *
 from protocol.zigbee_UART_protocol import ZIGBEE
 
@@ -65,7 +66,7 @@ class ArgHandle():
             dest='serial_port',
             action='store',
             default='5',
-            help='Specify serial port number',
+            help="Specify serial port number: 'x' for COMx, 'pty' or 'pty:/tmp/ttyV0' for a virtual port",
         )
         parser.add_argument(
             '--device',
@@ -109,9 +110,9 @@ class MyCmd(Cmd):
             '4': logging.DEBUG,
         }
         if int(arg) in range(5):
-            for i in self.sim_objs:
+            for sim in self.sim_objs.values():
                 cprint.notice_p("-" * 20)
-                self.sim_objs[i].LOG.set_level(level[arg])
+                sim.LOG.set_level(level[arg])
         else:
             cprint.warn_p("unknow log level: %s!" % (arg))
 
@@ -119,17 +120,17 @@ class MyCmd(Cmd):
         cprint.notice_p("show state")
 
     def do_st(self, arg, opts=None):
-        for i in self.sim_objs:
+        for sim in self.sim_objs.values():
             cprint.notice_p("-" * 20)
-            self.sim_objs[i].status_show()
+            sim.status_show()
 
     def help_set(self):
         cprint.notice_p("set state")
 
     def do_set(self, arg, opts=None):
         args = arg.split()
-        for i in self.sim_objs:
-            self.sim_objs[i].set_item(args[0], args[1])
+        for sim in self.sim_objs.values():
+            sim.set_item(args[0], args[1])
 
     def default(self, arg, opts=None):
         try:
@@ -190,8 +191,11 @@ if __name__ == '__main__':
     sims = {}
     log_level = logging.DEBUG
 
-    zigbee_obj = ZIGBEE('COM' + arg_handle.get_args('serial_port'),
-                        logger=LOG, time_delay=arg_handle.get_args('time_delay'))
+    serial_port = arg_handle.get_args('serial_port')
+    if not is_virtual(serial_port):
+        serial_port = 'COM' + serial_port
+    zigbee_obj = ZIGBEE(serial_port, logger=LOG,
+                        time_delay=arg_handle.get_args('time_delay'))
     zigbee_obj.run_forever()
     device_type = arg_handle.get_args('device_type')
     device_cls = chr(